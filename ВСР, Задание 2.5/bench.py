@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import gc
+import heapq
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+BASE_TIMESTAMP = 1_767_225_600
+DATE_SPAN = 30 * 24 * 60 * 60
+CHAT_COUNT = 10_000
+EXPIRATION_SIZES = (10_000, 100_000, 1_000_000)
+INSERT_BATCH_SIZE = 10_000
+PAGE_REQUESTS = 1000
+RENDER_SIZES = (10, 100, 1000, 10_000)
+REPEAT = 5
+PARSE_INPUTS = [
+    "10:20",
+    "10:20 23/12/2030",
+    "23:59 31/12/2099",
+    "7:5 1/2/2031",
+    "24:00 01/01/2030",
+    "10:61",
+    "10-20 23/12/2030",
+    "10:20 30/02/2030",
+    "10:20 23/13/2030",
+    "10:20 23.12.2030",
+    "10:20 23/12/2020"
+]
+NOTIFY_DELTAS = [
+    timedelta(seconds=5),
+    timedelta(minutes=1, seconds=1),
+    timedelta(hours=2, minutes=22),
+    timedelta(days=1, hours=11),
+    timedelta(days=45, minutes=3),
+    timedelta(days=400, hours=5, minutes=21, seconds=14)
+]
+
+def import_main() -> Any:
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    
+    sys.path.insert(0, SCRIPT_DIRECTORY)
+    import main
+    main.create_reminders_db()
+    return main
+
+@dataclass
+class DictReminder:
+    id: int
+    date: int
+    text: str
+    active: bool = True
+
+def get_reminder_row(i: int) -> tuple[int, int, int]:
+    return i + 1, i % CHAT_COUNT, BASE_TIMESTAMP + (i * 7919) % DATE_SPAN
+
+def build_reminders_dict(count: int) -> Any:
+    reminders: dict[int, list[DictReminder]] = {}
+    for i in range(count):
+        id, chat_id, date = get_reminder_row(i)
+        reminders.setdefault(chat_id, []).append(DictReminder(id, date, f"Напоминание номер {i}"))
+    return reminders
+
+def build_heap_with_dataclasses(count: int) -> Any:
+    queue: list[tuple[int, int, int]] = []
+    reminders: dict[tuple[int, int], DictReminder] = {}
+    for i in range(count):
+        id, chat_id, date = get_reminder_row(i)
+        reminders[(chat_id, id)] = DictReminder(id, date, f"Напоминание номер {i}")
+        heapq.heappush(queue, (date, chat_id, id))
+    return queue, reminders
+
+def build_scheduler(main: Any, count: int) -> Any:
+    scheduler = main.ReminderScheduler()
+    for i in range(count):
+        id, chat_id, date = get_reminder_row(i)
+        scheduler.push(chat_id, id, date)
+    return scheduler
+
+def measure_memory(build: Callable[[], Any]) -> dict[str, float]:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    
+    layout = build()
+    
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    del layout
+    return {"bytes": size, "build_seconds": elapsed}
+
+def run_memory(main: Any, count: int) -> dict[str, Any]:
+    layouts = {
+        "reminders_dict": lambda: build_reminders_dict(count),
+        "heap_with_dataclasses": lambda: build_heap_with_dataclasses(count),
+        "scheduler": lambda: build_scheduler(main, count)
+    }
+    
+    results = {}
+    for name, build in layouts.items():
+        result = measure_memory(build)
+        result["bytes_per_reminder"] = result["bytes"] / count
+        results[name] = result
+        print(f"memory/{name}: {result['bytes'] / 1024 / 1024:.1f} MiB, {result['bytes_per_reminder']:.0f} B per reminder, built in {result['build_seconds']:.2f} s")
+    
+    return {"count": count, "results": results}
+
+def time_calls(call: Callable[[], Any], number: int) -> dict[str, float]:
+    best = float("inf")
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        for _ in range(number):
+            call()
+        best = min(best, time.perf_counter() - started)
+    
+    return {"calls": number, "seconds": best, "microseconds_per_call": best / number * 1e6}
+
+def fill_reminders_db(main: Any, count: int, base: int) -> None:
+    main.reminder_scheduler.clear()
+    
+    with main.reminders_pool.connection() as conn:
+        conn.execute("DELETE FROM Reminders")
+        for start in range(0, count, INSERT_BATCH_SIZE):
+            conn.executemany(
+                "INSERT INTO Reminders (id, chat_id, expires_in, content) VALUES (?, ?, ?, ?)",
+                [(id, chat_id, base + date - BASE_TIMESTAMP, f"Напоминание номер {id}") for id, chat_id, date in map(get_reminder_row, range(start, min(count, start + INSERT_BATCH_SIZE)))]
+            )
+
+def run_expiration(main: Any, count: int) -> dict[str, Any]:
+    results = {}
+    for size in [size for size in EXPIRATION_SIZES if size <= count] or [count]:
+        now = int(main.get_current_timestamp())
+        base = now - DATE_SPAN - 1
+        fill_reminders_db(main, size, base)
+        main.reminder_delivery = main.ReminderDelivery()
+        
+        started = time.perf_counter()
+        loaded = main.load_reminders_window(now, base - 1)
+        load_seconds = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        asyncio.run(main.check_reminders_expiration())
+        fire_seconds = time.perf_counter() - started
+        
+        delivered = main.reminder_delivery.pending
+        results[size] = {
+            "loaded": loaded,
+            "delivered": delivered,
+            "load_seconds": load_seconds,
+            "fire_seconds": fire_seconds,
+            "reminders_per_second": delivered / fire_seconds if fire_seconds else 0.0
+        }
+        print(f"expiration/{size}: loaded in {load_seconds:.3f} s, fired {delivered} in {fire_seconds:.3f} s ({results[size]['reminders_per_second']:.0f}/s)")
+    
+    return {"results": results}
+
+def run_pages(main: Any, count: int) -> dict[str, Any]:
+    fill_reminders_db(main, count, BASE_TIMESTAMP)
+    rng = random.Random(0)
+    chat_ids = [rng.randrange(min(count, CHAT_COUNT)) for _ in range(PAGE_REQUESTS)]
+    
+    def get_pages() -> None:
+        for chat_id in chat_ids:
+            page = main.get_reminders_page(chat_id)
+            if page.has_next:
+                last = page.reminders[-1]
+                main.get_reminders_page(chat_id, main.PageDirection.NEXT, (last.date, last.id), len(page.reminders))
+    
+    def load_window() -> None:
+        main.reminder_scheduler.clear()
+        main.load_reminders_window(BASE_TIMESTAMP + main.REMINDERS_LOAD_HORIZON, BASE_TIMESTAMP)
+    
+    results = {
+        "get_reminders_page": time_calls(get_pages, 1),
+        "load_reminders_window": time_calls(load_window, 1)
+    }
+    results["get_reminders_page"]["microseconds_per_call"] /= len(chat_ids)
+    results["load_reminders_window"]["loaded"] = len(main.reminder_scheduler)
+    
+    print(f"pages/get_reminders_page: {results['get_reminders_page']['microseconds_per_call']:.0f} us per chat over {count} reminders")
+    print(f"pages/load_reminders_window: {results['load_reminders_window']['loaded']} reminders in {results['load_reminders_window']['seconds']:.3f} s")
+    return {"count": count, "results": results}
+
+def run_render(main: Any, count: int) -> dict[str, Any]:
+    results = {}
+    for size in RENDER_SIZES:
+        reminders = [
+            main.Reminder(i, BASE_TIMESTAMP + i * 60, f"Напоминание номер {i} " * (1 + i % 40), i % 3 != 0, (main.TimeUnit.DAY, 1) if i % 10 == 0 else None)
+            for i in range(size)
+        ]
+        results[size] = time_calls(lambda: main.get_current_reminders_text(reminders), max(1, 10_000 // size))
+        print(f"render/{size}: {results[size]['microseconds_per_call']:.0f} us per list")
+    
+    return {"results": results}
+
+def run_parse(main: Any, count: int) -> dict[str, Any]:
+    now = datetime(2030, 6, 15, 12, 0)
+    
+    def parse_all() -> None:
+        for text in PARSE_INPUTS:
+            try:
+                main.parse_reminder_date(text, now)
+            except ValueError:
+                pass
+    
+    result = time_calls(parse_all, 10_000)
+    result["microseconds_per_call"] /= len(PARSE_INPUTS)
+    print(f"parse/parse_reminder_date: {result['microseconds_per_call']:.2f} us per input")
+    return {"results": {"parse_reminder_date": result}}
+
+def run_notifies(main: Any, count: int) -> dict[str, Any]:
+    now = datetime(2030, 6, 15, 12, 0)
+    words = main.TIME_UNIT_CASES[main.TimeUnit.DAY]
+    
+    def get_word_cases() -> None:
+        for value in range(1000):
+            main.get_word_case(value, words)
+    
+    def get_notifies_in_texts() -> None:
+        for delta in NOTIFY_DELTAS:
+            main.get_notifies_in_text(now + delta, now)
+    
+    results = {
+        "get_word_case": time_calls(get_word_cases, 100),
+        "get_notifies_in_text": time_calls(get_notifies_in_texts, 1000)
+    }
+    results["get_word_case"]["microseconds_per_call"] /= 1000
+    results["get_notifies_in_text"]["microseconds_per_call"] /= len(NOTIFY_DELTAS)
+    
+    for name, result in results.items():
+        print(f"notifies/{name}: {result['microseconds_per_call']:.2f} us per call")
+    return {"results": results}
+
+SUITES = {
+    "memory": run_memory,
+    "expiration": run_expiration,
+    "pages": run_pages,
+    "render": run_render,
+    "parse": run_parse,
+    "notifies": run_notifies
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the bot's reminder and weather code")
+    parser.add_argument("suites", nargs="*", help=f"Suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+    
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    
+    output = os.path.abspath(args.output) if args.output else None
+    main = import_main()
+    
+    report = {"timestamp": int(time.time()), "python": sys.version.split()[0], "suites": {}}
+    for suite in args.suites or SUITES:
+        report["suites"][suite] = SUITES[suite](main, args.count)
+    
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,140 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+import zlib
+from collections import Counter
+from typing import Any
+
+from aiohttp import web
+
+STATS_INTERVAL = 5
+HANG_SECONDS = 30
+
+class FakeOwm:
+    def __init__(self, latency: float, jitter: float, error_rate: float, error_status: int, hang_rate: float, outages: list[tuple[float, float]]) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.outages = outages
+        self.random = random.Random(0)
+        self.started = time.perf_counter()
+        self.statuses: Counter[int] = Counter()
+        self.endpoints: Counter[str] = Counter()
+        self.hung = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+    
+    def build_observation(self, id: int, name: str) -> dict[str, Any]:
+        rng = random.Random(id)
+        temp = 273.15 + rng.uniform(-20, 30)
+        return {
+            "id": id,
+            "name": name,
+            "coord": {"lon": rng.uniform(-180, 180), "lat": rng.uniform(-90, 90)},
+            "sys": {"country": "RU"},
+            "dt": int(time.time()),
+            "weather": [{"id": 800, "main": "Clear", "description": "ясно", "icon": "01d"}],
+            "main": {"temp": temp, "temp_min": temp - 2, "temp_max": temp + 2, "feels_like": temp - 1, "pressure": 1013, "humidity": rng.randrange(30, 90)},
+            "wind": {"speed": round(rng.uniform(0, 10), 1), "deg": rng.randrange(360)},
+            "clouds": {"all": 0},
+            "visibility": 10000
+        }
+    
+    def is_down(self) -> bool:
+        elapsed = time.perf_counter() - self.started
+        return any(start <= elapsed < end for start, end in self.outages)
+    
+    def build_response(self, endpoint: str, query: dict[str, str]) -> tuple[int, Any]:
+        if self.is_down() or self.random.random() < self.error_rate:
+            return self.error_status, {"cod": self.error_status, "message": "injected error"}
+        
+        if endpoint == "group":
+            observations = [self.build_observation(int(id), f"City {id}") for id in query["id"].split(",")]
+            return 200, {"cnt": len(observations), "list": observations}
+        
+        if "id" in query:
+            return 200, self.build_observation(int(query["id"]), f"City {query['id']}")
+        
+        name = query.get("q", "")
+        return 200, self.build_observation(zlib.crc32(name.casefold().encode()) % 10_000_000, name)
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        started = time.perf_counter()
+        endpoint = request.match_info["endpoint"]
+        self.endpoints[endpoint] += 1
+        
+        if self.random.random() < self.hang_rate:
+            self.hung += 1
+            await asyncio.sleep(HANG_SECONDS)
+        
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        
+        status, data = self.build_response(endpoint, dict(request.query))
+        self.statuses[status] += 1
+        
+        latency = time.perf_counter() - started
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return web.json_response(data, status=status)
+    
+    def get_stats(self) -> dict[str, Any]:
+        requests = sum(self.statuses.values())
+        return {
+            "elapsed": time.perf_counter() - self.started,
+            "down": self.is_down(),
+            "requests": requests,
+            "statuses": dict(self.statuses),
+            "endpoints": dict(self.endpoints),
+            "hung": self.hung,
+            "latency_avg": self.latency_total / requests if requests else 0.0,
+            "latency_max": self.latency_max
+        }
+    
+    async def log_stats(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            logging.info("%s", json.dumps(self.get_stats(), ensure_ascii=False))
+
+async def start_stats(app: web.Application) -> None:
+    app["stats_task"] = asyncio.create_task(app["owm"].log_stats())
+
+async def stop_stats(app: web.Application) -> None:
+    app["stats_task"].cancel()
+    logging.info("%s", json.dumps(app["owm"].get_stats(), ensure_ascii=False))
+
+def create_app(owm: FakeOwm) -> web.Application:
+    app = web.Application()
+    app["owm"] = owm
+    app.router.add_get("/{endpoint}", owm.handle)
+    app.on_startup.append(start_stats)
+    app.on_cleanup.append(stop_stats)
+    return app
+
+def parse_outage(text: str) -> tuple[float, float]:
+    start, _, end = text.partition(":")
+    return float(start), float(end)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenWeatherMap API, run the bot with --owm-api http://HOST:PORT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra random seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=502)
+    parser.add_argument("--hang-rate", type=float, default=0.0, help=f"Share of requests held for {HANG_SECONDS} s before answering")
+    parser.add_argument("--outage", type=parse_outage, action="append", default=[], metavar="START:END", help="Fail every request between these seconds after startup")
+    args = parser.parse_args()
+    
+    owm = FakeOwm(args.latency, args.jitter, args.error_rate, args.error_status, args.hang_rate, args.outage)
+    web.run_app(create_app(owm), host=args.host, port=args.port, print=None, access_log=None)
@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bot", "username": "bot"}
+UPDATE_TEXTS = ["/rps камень", "/rps ножницы", "/rps бумага"]
+STATS_INTERVAL = 5
+WEBHOOK_CONCURRENCY = 100
+
+class FakeTelegram:
+    def __init__(self, chats: int, updates: int, concurrency: int = WEBHOOK_CONCURRENCY, documents: list[str] | None = None, messages: list[str] | None = None) -> None:
+        self.chats = chats
+        self.concurrency = concurrency
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.pending = [self.build_message_update(i % chats + 1, UPDATE_TEXTS[i % len(UPDATE_TEXTS)]) for i in range(updates)]
+        self.served = 0
+        self.calls: Counter[str] = Counter()
+        self.sent: Counter[int] = Counter()
+        self.reminders: Counter[tuple[int, str]] = Counter()
+        self.started = time.perf_counter()
+        self.webhook_task: asyncio.Task | None = None
+        self.webhook_statuses: Counter[int] = Counter()
+        self.webhook_latency_total = 0.0
+        self.webhook_latency_max = 0.0
+        self.webhook_seconds = 0.0
+        self.files: dict[str, bytes] = {}
+        self.documents_received: list[tuple[str, int]] = []
+        self.log_messages = bool(documents or messages)
+        
+        for i, path in enumerate(documents or []):
+            self.pending.append(self.build_document_update(i % chats + 1, "/import", path))
+        for i, text in enumerate(messages or []):
+            self.pending.append(self.build_message_update(i % chats + 1, text))
+    
+    def build_message_update(self, chat_id: int, text: str) -> dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text
+        }
+        
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        
+        return {"update_id": next(self.update_ids), "message": message}
+    
+    def build_document_update(self, chat_id: int, caption: str, path: str) -> dict[str, Any]:
+        with open(path, "rb") as f:
+            content = f.read()
+        
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = content
+        
+        update = self.build_message_update(chat_id, caption)
+        message = update["message"]
+        message["caption"] = message.pop("text")
+        message["caption_entities"] = message.pop("entities", [])
+        message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": os.path.basename(path), "file_size": len(content)}
+        return update
+    
+    def build_message(self, chat_id: int, text: str) -> dict[str, Any]:
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text
+        }
+    
+    async def get_updates(self, params: dict[str, str]) -> list[dict[str, Any]]:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = int(params.get("timeout", 0))
+        
+        self.pending = [update for update in self.pending if update["update_id"] >= offset]
+        if not self.pending:
+            await asyncio.sleep(min(timeout, 1))
+            return []
+        
+        updates = self.pending[:limit]
+        self.served += len(updates)
+        return updates
+    
+    async def post_update(self, session: aiohttp.ClientSession, url: str, secret: str, update: dict[str, Any]) -> None:
+        started = time.perf_counter()
+        
+        try:
+            async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+                status = response.status
+        except aiohttp.ClientError:
+            status = 0
+        
+        latency = time.perf_counter() - started
+        self.webhook_statuses[status] += 1
+        self.webhook_latency_total += latency
+        self.webhook_latency_max = max(self.webhook_latency_max, latency)
+    
+    async def post_updates(self, url: str, secret: str) -> None:
+        updates, self.pending = self.pending, []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.perf_counter()
+        
+        async def post(update: dict[str, Any]) -> None:
+            async with semaphore:
+                await self.post_update(session, url, secret, update)
+        
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(post(update) for update in updates))
+        
+        self.served += len(updates)
+        self.webhook_seconds = time.perf_counter() - started
+        logging.info("Posted %d updates to %s in %.3f s", len(updates), url, self.webhook_seconds)
+    
+    def set_webhook(self, params: dict[str, str]) -> bool:
+        if self.webhook_task is None and self.pending:
+            self.webhook_task = asyncio.create_task(self.post_updates(params["url"], params.get("secret_token", "")))
+        
+        return True
+    
+    def send_message(self, params: dict[str, str]) -> dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        text = params["text"]
+        
+        self.sent[chat_id] += 1
+        if self.log_messages:
+            logging.info("Message to %d:\n%s", chat_id, text)
+        if text.startswith("Напоминание:"):
+            self.reminders[(chat_id, text)] += 1
+        
+        return self.build_message(chat_id, text)
+    
+    async def handle_file(self, request: web.Request) -> web.Response:
+        content = self.files.get(request.match_info["path"])
+        if content is None:
+            return web.Response(status=404)
+        
+        return web.Response(body=content)
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        form = await request.post()
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        self.calls[method] += 1
+        
+        for value in form.values():
+            if isinstance(value, web.FileField):
+                content = value.file.read()
+                self.documents_received.append((value.filename, len(content)))
+                logging.info("Received %s (%d bytes):\n%s", value.filename, len(content), content.decode("utf-8-sig", errors="replace"))
+        
+        if method == "getupdates":
+            result: Any = await self.get_updates(params)
+        elif method == "sendmessage":
+            result = self.send_message(params)
+        elif method == "editmessagetext":
+            result = self.build_message(int(params.get("chat_id", 0)), params["text"])
+        elif method == "setwebhook":
+            result = self.set_webhook(params)
+        elif method == "getme":
+            result = BOT_USER
+        elif method == "getfile":
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"], "file_path": params["file_id"]}
+        elif method == "senddocument":
+            result = self.build_message(int(params["chat_id"]), "")
+        else:
+            result = True
+        
+        return web.json_response({"ok": True, "result": result})
+    
+    def get_stats(self) -> dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        posted = sum(self.webhook_statuses.values())
+        return {
+            "elapsed": elapsed,
+            "updates_served": self.served,
+            "updates_pending": len(self.pending),
+            "messages_sent": sum(self.sent.values()),
+            "messages_per_second": sum(self.sent.values()) / elapsed,
+            "reminders_delivered": len(self.reminders),
+            "reminders_duplicated": sum(count - 1 for count in self.reminders.values()),
+            "webhook_posted": posted,
+            "webhook_statuses": dict(self.webhook_statuses),
+            "webhook_updates_per_second": posted / self.webhook_seconds if self.webhook_seconds else 0.0,
+            "webhook_latency_avg": self.webhook_latency_total / posted if posted else 0.0,
+            "webhook_latency_max": self.webhook_latency_max,
+            "documents_received": len(self.documents_received),
+            "calls": dict(self.calls)
+        }
+    
+    async def log_stats(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            logging.info("%s", json.dumps(self.get_stats(), ensure_ascii=False))
+
+async def start_stats(app: web.Application) -> None:
+    app["stats_task"] = asyncio.create_task(app["telegram"].log_stats())
+
+async def stop_stats(app: web.Application) -> None:
+    app["stats_task"].cancel()
+    logging.info("%s", json.dumps(app["telegram"].get_stats(), ensure_ascii=False))
+
+def create_app(telegram: FakeTelegram) -> web.Application:
+    app = web.Application()
+    app["telegram"] = telegram
+    app.router.add_post("/bot{token}/{method}", telegram.handle)
+    app.router.add_get("/file/bot{token}/{path}", telegram.handle_file)
+    app.on_startup.append(start_stats)
+    app.on_cleanup.append(stop_stats)
+    return app
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    
+    parser = argparse.ArgumentParser(description="Local stand-in for the Telegram Bot API, run the bot with --telegram-api http://HOST:PORT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=0, help="Number of /rps messages to queue; they are POSTed to the webhook once the bot sets one, otherwise served by getUpdates")
+    parser.add_argument("--concurrency", type=int, default=WEBHOOK_CONCURRENCY, help="Concurrent webhook requests")
+    parser.add_argument("--document", action="append", default=[], help="File to send as an /import document; documents the bot sends back are logged")
+    parser.add_argument("--message", action="append", default=[], help="Text message to send; replies are logged when documents or messages are given")
+    args = parser.parse_args()
+    
+    web.run_app(create_app(FakeTelegram(args.chats, args.updates, args.concurrency, args.document, args.message)), host=args.host, port=args.port, print=None, access_log=None)
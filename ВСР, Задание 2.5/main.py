@@ -1,43 +1,112 @@
+import time
+
+STARTUP_TIME = time.perf_counter()
+
 import asyncio
 import logging
 import sys
 import os
+import signal
+import socket
+import queue
+import multiprocessing
+import multiprocessing.queues
+import argparse
+import secrets
+import hmac
 import random
+import bisect
+import re
 import sqlite3
+import heapq
+import threading
+import itertools
+import json
+import html
+import csv
+import io
+import tempfile
+import gzip
+import zlib
+from array import array
 from datetime import datetime, UTC
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from dataclasses import dataclass
 import calendar
-from typing import Any, Self
+from typing import Any, Self, TypeVar, TextIO, BinaryIO, TYPE_CHECKING
 from enum import Enum
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from collections.abc import Iterator, Iterable, Awaitable, Callable, Mapping
 
-from dateutil.relativedelta import relativedelta
-
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+import aiohttp
+from aiohttp import web
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter, TelegramNetworkError, TelegramServerError
 from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.filters.callback_data import CallbackData
-from aiogram.types import Message, ReplyKeyboardRemove, BotCommand, CallbackQuery
+from aiogram.types import Message, ReplyKeyboardRemove, BotCommand, CallbackQuery, Update, Document, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
 
-from pyowm.config import DEFAULT_CONFIG as OWM_DEFAULT_CONFIG
-from pyowm import OWM
-from pyowm.weatherapi25.weather import Weather
-from pyowm.weatherapi25.location import Location
-from pyowm.commons.exceptions import NotFoundError as OwmNotFoundError
+if TYPE_CHECKING:
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from dateutil.relativedelta import relativedelta
+    from pyowm.weatherapi25.observation import Observation
+    from pyowm.weatherapi25.weather import Weather
+    from pyowm.weatherapi25.location import Location
 
-with open("./telegram_token.txt", "r") as f:
-    TELEGRAM_TOKEN = f.read()
-    
-with open("./owm_token.txt", "r") as f:
-    OWM_TOKEN = f.read()
+TELEGRAM_TOKEN_PATH = "./telegram_token.txt"
+OWM_TOKEN_PATH = "./owm_token.txt"
 
-OWM_CONFIG = OWM_DEFAULT_CONFIG | {
-    'language': 'ru'
+OWM_LANGUAGE = "ru"
+OWM_TIMEOUT = 3
+OWM_DEADLINE = 6
+OWM_MAX_ATTEMPTS = 3
+OWM_RETRY_DELAY = 0.2
+OWM_RETRY_BUDGET_RATIO = 0.1
+OWM_RETRY_BUDGET_RESERVE = 10
+OWM_BREAKER_FAILURES = 5
+OWM_BREAKER_COOLDOWN = 30
+OWM_API_URL = "https://api.openweathermap.org/data/2.5"
+WEATHER_MAX_CONCURRENCY = 16
+WEATHER_MAX_CONNECTIONS = 32
+WEATHER_KEEPALIVE_TIMEOUT = 60
+WEATHER_CACHE_TTL = 10 * 60
+WEATHER_CACHE_SIZE = 1024
+WEATHER_STALE_TTL = 60 * 60
+WEATHER_MAX_STALE = 24 * 60 * 60
+WEATHER_STALE_TIMEOUT = 2
+WEATHER_FLUSH_INTERVAL = 5
+WEATHER_MAX_PLACES = 20
+PREFETCH_INTERVAL = 60
+PREFETCH_TOP_K = 50
+PREFETCH_CALLS_PER_MINUTE = 30
+PREFETCH_HALF_LIFE = 30 * 60
+PREFETCH_LEAD = 2 * PREFETCH_INTERVAL
+PREFETCH_MIN_SCORE = 0.05
+PREFETCH_MAX_TRACKED = 10_000
+OWM_GROUP_SIZE = 20
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+CITIES_DATABASE = "./databases/cities.db"
+CITIES_LANGUAGES = ("ru", "en")
+CITIES_MMAP_SIZE = 128 * 1024 * 1024
+CITIES_SUGGESTIONS = 5
+CITIES_MAX_FUZZY_LENGTH = 24
+
+CITY_ALIASES = {
+    "мск": ("Moscow", "RU"),
+    "спб": ("Saint Petersburg", "RU"),
+    "питер": ("Saint Petersburg", "RU"),
+    "екб": ("Yekaterinburg", "RU"),
+    "нск": ("Novosibirsk", "RU"),
+    "нн": ("Nizhniy Novgorod", "RU")
 }
 
 COUNTRY_CODE_TO_COUNTRY_NAME = {
@@ -544,24 +613,113 @@ COUNTRY_CODE_TO_FLAG = {
     "AX": '🇦🇽',
 }
 
-@dataclass
+class TimeUnit(Enum):
+    YEAR = 1
+    MONTH = 2
+    DAY = 3
+    HOUR = 4
+    MINUTE = 5
+    SECOND = 6
+
+TIME_UNIT_CASES = {
+    TimeUnit.YEAR: ("год", "года", "лет"),
+    TimeUnit.MONTH: ("месяц", "месяца", "месяцев"),
+    TimeUnit.DAY: ("день", "дня", "дней"),
+    TimeUnit.HOUR: ("час", "часа", "часов"),
+    TimeUnit.MINUTE: ("минуту", "минуты", "минут"),
+    TimeUnit.SECOND: ("секунду", "секунды", "секунд")
+}
+
+TIME_UNIT_MAX_SECONDS = {
+    TimeUnit.YEAR: 366 * 24 * 60 * 60,
+    TimeUnit.MONTH: 31 * 24 * 60 * 60,
+    TimeUnit.DAY: 24 * 60 * 60,
+    TimeUnit.HOUR: 60 * 60,
+    TimeUnit.MINUTE: 60,
+    TimeUnit.SECOND: 1
+}
+
+REPEAT_PRESETS = {
+    "каждую минуту": (TimeUnit.MINUTE, 1),
+    "ежечасно": (TimeUnit.HOUR, 1),
+    "каждый час": (TimeUnit.HOUR, 1),
+    "ежедневно": (TimeUnit.DAY, 1),
+    "каждый день": (TimeUnit.DAY, 1),
+    "еженедельно": (TimeUnit.DAY, 7),
+    "каждую неделю": (TimeUnit.DAY, 7),
+    "ежемесячно": (TimeUnit.MONTH, 1),
+    "каждый месяц": (TimeUnit.MONTH, 1),
+    "ежегодно": (TimeUnit.YEAR, 1),
+    "каждый год": (TimeUnit.YEAR, 1)
+}
+
+REPEAT_UNIT_STEMS = (
+    ("минут", TimeUnit.MINUTE, 1),
+    ("час", TimeUnit.HOUR, 1),
+    ("дн", TimeUnit.DAY, 1),
+    ("ден", TimeUnit.DAY, 1),
+    ("недел", TimeUnit.DAY, 7),
+    ("месяц", TimeUnit.MONTH, 1),
+    ("год", TimeUnit.YEAR, 1),
+    ("лет", TimeUnit.YEAR, 1)
+)
+
+EVERY_TIME_UNIT = {
+    TimeUnit.YEAR: "каждый год",
+    TimeUnit.MONTH: "каждый месяц",
+    TimeUnit.DAY: "каждый день",
+    TimeUnit.HOUR: "каждый час",
+    TimeUnit.MINUTE: "каждую минуту",
+    TimeUnit.SECOND: "каждую секунду"
+}
+
+REPEAT_MAX_EVERY = 1000
+
+ICAL_FREQUENCIES = {
+    "YEARLY": (TimeUnit.YEAR, 1),
+    "MONTHLY": (TimeUnit.MONTH, 1),
+    "WEEKLY": (TimeUnit.DAY, 7),
+    "DAILY": (TimeUnit.DAY, 1),
+    "HOURLY": (TimeUnit.HOUR, 1),
+    "MINUTELY": (TimeUnit.MINUTE, 1)
+}
+
+ICAL_UNIT_FREQUENCIES = {
+    TimeUnit.YEAR: "YEARLY",
+    TimeUnit.MONTH: "MONTHLY",
+    TimeUnit.DAY: "DAILY",
+    TimeUnit.HOUR: "HOURLY",
+    TimeUnit.MINUTE: "MINUTELY",
+    TimeUnit.SECOND: "SECONDLY"
+}
+
+ICAL_LINE_LIMIT = 75
+ICAL_ALL_DAY_HOUR = 9
+ICAL_ESCAPES = {"\\": "\\", ";": ";", ",": ",", "n": "\n", "N": "\n"}
+ICAL_ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+REPEAT_PROMPT = """Как часто повторять напоминание? Например:
+<b>ежедневно</b>, <b>еженедельно</b>, <b>ежемесячно</b>, <b>ежегодно</b>, <b>каждые 3 часа</b>, <b>каждые 2 недели</b>"""
+
+@dataclass(slots=True)
 class Reminder:
     id: int
     date: int
     text: str
     active: bool = True
+    repeat: tuple[TimeUnit, int] | None = None
 
 class NewReminderState(StatesGroup):
     text = State()
     date = State()
+    repeat = State()
 
-class TimeUnit(Enum):
-    YEAR = 1
-    MONTH = 2
-    DAY = 3
-    HOUR = 4
-    MINUTE = 5
-    SECOND = 6
+class ImportRemindersState(StatesGroup):
+    document = State()
+
+class ReminderFormat(str, Enum):
+    CSV = "csv"
+    ICAL = "ics"
 
 class ReminderAction(str, Enum):
     DELETE_COMPLETED = "delete_completed"
@@ -569,343 +727,3140 @@ class ReminderAction(str, Enum):
 class ReminderCallback(CallbackData, prefix="reminder"):
     action: ReminderAction
 
-REMINDERS: dict[int, list[Reminder]] = {}
+class PageDirection(str, Enum):
+    NEXT = "next"
+    PREVIOUS = "prev"
 
-WEATHER_COMMAND = BotCommand(command="weather", description="Получить прогноз погоды")
-RPS_COMMAND = BotCommand(command="rps", description="Сыграть в камень, ножницы, бумага")
-REMINDERS_COMMAND = BotCommand(command="reminders", description="Получить список всех напоминаний")
-REMINDER_COMMAND = BotCommand(command="reminder", description="Создать напоминание")
-CANCEL_COMMAND = BotCommand(command="cancel", description="Отменить текущее действие")
+class ReminderPageCallback(CallbackData, prefix="reminders_page"):
+    direction: PageDirection
+    expires_in: int
+    id: int
+    offset: int
 
-ALL_COMMANDS = [
-    WEATHER_COMMAND,
-    RPS_COMMAND,
-    REMINDERS_COMMAND,
-    REMINDER_COMMAND,
-    CANCEL_COMMAND
-]
+@dataclass
+class ReminderPage:
+    reminders: list[Reminder]
+    offset: int
+    has_previous: bool
+    has_next: bool
+    has_completed: bool
 
-START_MESSAGE = """
-Здравствуйте!
+REMINDER_DATE_EXAMPLE = "10:20 23/12/2025"
+REMINDERS_PAGE_SIZE = 10
+REMINDERS_EXPORT_PAGE_SIZE = 1000
+REMINDERS_IMPORT_BATCH_SIZE = 500
+REMINDERS_IMPORT_MAX_ROWS = 10_000
+REMINDERS_IMPORT_MAX_FILE_SIZE = 2 * 1024 * 1024
+REMINDERS_IMPORT_TEXT_LIMIT = 4000
+REMINDERS_IMPORT_ERRORS_SHOWN = 10
+REMINDERS_PAGE_TEXT_LIMIT = 300
 
-Я бот, созданный при выполнении задания ВСР 2.5 по учебной практике 1 курса в РГПУ им. Герцена.
+DATABASES_DIRECTORY = "./databases/"
+REMINDERS_DATABASE = "./databases/reminders.db"
+REMINDERS_DATABASE_POOL_SIZE = 8
+REMINDERS_DATABASE_IDLE_TIMEOUT = 5 * 60
+REMINDERS_DATABASE_CACHED_STATEMENTS = 64
+REMINDERS_DATABASE_MMAP_SIZE = 256 * 1024 * 1024
+STATS_LOG_INTERVAL = 10 * 60
+REMINDERS_WRITER_BATCH_SIZE = 512
+REMINDERS_WRITER_BATCH_DELAY = 0.005
+FSM_STATE_TTL = 60 * 60
+FSM_CACHE_SIZE = 10_000
+FSM_PURGE_INTERVAL = 10 * 60
 
-Мои возможности:
-    - Показывать текущую погоду в любом городе мира с помощью команды /weather
-    - Играть в камень, ножницы, бумага с помощью команды /rps
-    - Создавать напоминания с помощью команды /reminder
-    
-Остальные команды:
-    /cancel - Отменить текущее действие (Например создание напоминания)
-    /reminders - Показать список всех напоминаний
-"""
+DELIVERY_WORKERS = 16
+DELIVERY_GLOBAL_RATE = 30
+DELIVERY_CHAT_RATE = 1
+DELIVERY_MAX_ATTEMPTS = 5
+DELIVERY_RETRY_DELAY = 1.0
+DELIVERY_MAX_CHAT_BUCKETS = 10_000
+DELIVERY_DRAIN_TIMEOUT = 10
 
-owm = OWM(OWM_TOKEN, config=OWM_CONFIG)
-mgr = owm.weather_manager()
+REMINDERS_SCHEDULER_MAX_SLEEP = 60
+REMINDERS_SCHEDULER_SLOT_BITS = 32
+REMINDERS_SCHEDULER_SLOT_MASK = (1 << REMINDERS_SCHEDULER_SLOT_BITS) - 1
+REMINDERS_TEXT_BATCH_SIZE = 500
+REMINDERS_LOAD_HORIZON = 24 * 60 * 60
+REMINDERS_LOAD_INTERVAL = 60 * 60
+REMINDERS_LOAD_PAGE_SIZE = 1000
+REMINDERS_RETENTION = 7 * 24 * 60 * 60
+REMINDERS_COMPACTION_INTERVAL = 60 * 60
+REMINDERS_COMPACTION_BATCH_SIZE = 5000
+REMINDERS_VACUUM_PAGES = 2000
+REMINDERS_POLL_INTERVAL = 1
 
-bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="html"))
-dp = Dispatcher()
-reminder_router = Router()
+SUBSCRIPTIONS_POLL_INTERVAL = 10
+SUBSCRIPTIONS_MAX_PER_CHAT = 10
+SUBSCRIPTIONS_CATCHUP_MINUTES = 5
+SUBSCRIBE_PATTERN = re.compile(r"(.+?)\s+(\d{1,2}):(\d{2})")
+MINUTES_PER_DAY = 24 * 60
 
-def get_word_case(count: int, words: list[str]) -> str:
-    ONE = 0
-    FEW = 1
-    OTHER = 2
+LEADER_LEASE_NAME = "reminders"
+LEADER_LEASE_TTL = 15
+LEADER_LEASE_RENEW_INTERVAL = 5
+LEADER_CATCHUP_LIMIT = 10 * 60
+
+WORKER_QUEUE_SIZE = 256
+WORKER_MAX_CONCURRENT_UPDATES = 64
+WORKER_SHUTDOWN_TIMEOUT = 10
+WORKER_PARENT_CHECK_INTERVAL = 1
+POLLING_TIMEOUT = 30
+POLLING_RETRY_DELAY = 1
+
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_QUEUE_SIZE = 10_000
+WEBHOOK_WORKERS = 64
+WEBHOOK_MAX_CONNECTIONS = 100
+WEBHOOK_SHUTDOWN_TIMEOUT = 10
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+METRICS_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_DATABASE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+METRICS_LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0)
+
+SQL_TABLE_PATTERN = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+class ReminderScheduler:
+    def __init__(self) -> None:
+        self.queue: list[int] = []
+        self.slots: dict[int, int] = {}
+        self.ids = array("q")
+        self.dates = array("q")
+        self.chat_ids = array("q")
+        self.free_slots = array("q")
+        self.stale_count = 0
+        self.loaded_until = 0
+        self.fired_until = 0
+        self.last_seen_id = 0
+        self.lock = threading.Lock()
+        self.wakeup = asyncio.Event()
+        self.loop: asyncio.AbstractEventLoop | None = None
     
-    if (count % 10 == 1) and not (count % 100 == 11):
-        return words[ONE]
+    def __len__(self) -> int:
+        return len(self.slots)
     
-    if (count % 100) > 11 and (count % 100) <= 15:
-        return words[OTHER]
+    def store(self, chat_id: int, id: int, date: int) -> int:
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.ids[slot] = id
+            self.dates[slot] = date
+            self.chat_ids[slot] = chat_id
+        else:
+            slot = len(self.ids)
+            self.ids.append(id)
+            self.dates.append(date)
+            self.chat_ids.append(chat_id)
+        
+        self.slots[id] = slot
+        return date << REMINDERS_SCHEDULER_SLOT_BITS | slot
     
-    if (count % 10 >= 2) and (count % 10 <= 4):
-        return words[FEW]
+    def push(self, chat_id: int, id: int, date: int) -> None:
+        with self.lock:
+            if id in self.slots:
+                return
+            
+            key = self.store(chat_id, id, date)
+            heapq.heappush(self.queue, key)
+            is_next = self.queue[0] == key
+        
+        if is_next:
+            self.notify()
     
-    return words[OTHER]
-
-def create_reminders_db(chat_id: int) -> None:
-    database_file = f"./databases/{chat_id}.db"
+    def push_many_if_loaded(self, reminders: Iterable[tuple[int, int, int]]) -> None:
+        with self.lock:
+            head = self.queue[0] if self.queue else None
+            keys = [
+                self.store(chat_id, id, date)
+                for chat_id, id, date in reminders
+                if id not in self.slots and self.fired_until < date <= self.loaded_until
+            ]
+            
+            if len(keys) > len(self.queue):
+                self.queue.extend(keys)
+                heapq.heapify(self.queue)
+            else:
+                for key in keys:
+                    heapq.heappush(self.queue, key)
+            
+            is_next = bool(self.queue) and self.queue[0] != head
+        
+        if is_next:
+            self.notify()
     
-    if os.path.exists(database_file):
-        os.remove(database_file)
+    def push_if_loaded(self, chat_id: int, id: int, date: int) -> None:
+        with self.lock:
+            loaded = self.fired_until < date <= self.loaded_until
+        
+        if loaded:
+            self.push(chat_id, id, date)
     
-    with sqlite3.connect(database_file) as conn:
-        conn.execute("CREATE TABLE Reminders (id INTEGER PRIMARY KEY AUTOINCREMENT, expires_in INTEGER, content TEXT)")
-
-def add_reminder(chat_id: int, text: str, date: int) -> None:
-    database_file = f"./databases/{chat_id}.db"
+    def advance_window(self, timestamp: int, until: int) -> int:
+        with self.lock:
+            start = max(self.loaded_until, timestamp)
+            self.loaded_until = max(self.loaded_until, until)
+        
+        return start
     
-    with sqlite3.connect(database_file) as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO Reminders (expires_in, content) VALUES (?, ?)", (date, text))
+    def discard(self, id: int) -> None:
+        with self.lock:
+            slot = self.slots.pop(id, None)
+            if slot is None:
+                return
+            
+            self.ids[slot] = -1
+            self.stale_count += 1
+            if self.stale_count > len(self.queue) // 2:
+                self.rebuild()
+    
+    def rebuild(self) -> None:
+        queue: list[int] = []
+        for key in self.queue:
+            slot = key & REMINDERS_SCHEDULER_SLOT_MASK
+            if self.ids[slot] == -1:
+                self.free_slots.append(slot)
+            else:
+                queue.append(key)
         
-        if not chat_id in REMINDERS:
-            REMINDERS[chat_id] = []
+        heapq.heapify(queue)
+        self.queue = queue
+        self.stale_count = 0
+    
+    def compact(self) -> int:
+        with self.lock:
+            stale_count = self.stale_count
+            self.rebuild()
         
-        REMINDERS[chat_id].append(Reminder(cur.lastrowid, date, text))
-
-def get_reminders(chat_id: int) -> list[Reminder]:
-    database_file = f"./databases/{chat_id}.db"
+        return stale_count
     
-    now = datetime.now()
-    timestamp = calendar.timegm(now.timetuple())
+    def clear(self) -> None:
+        with self.lock:
+            self.queue = []
+            self.slots = {}
+            self.ids = array("q")
+            self.dates = array("q")
+            self.chat_ids = array("q")
+            self.free_slots = array("q")
+            self.stale_count = 0
+            self.loaded_until = 0
+            self.fired_until = 0
+            self.last_seen_id = 0
     
-    result = None
-    with sqlite3.connect(database_file) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM Reminders")
-        result = cur.fetchall()
+    def pop_due(self, timestamp: float) -> list[tuple[int, int, int]]:
+        due: list[tuple[int, int, int]] = []
         
-    def row_to_reminder(row: list[Any]) -> Reminder:
-        id = int(row[0])
-        date = int(row[1])
-        text = str(row[2])
-        active = timestamp < date
+        with self.lock:
+            self.fired_until = max(self.fired_until, int(timestamp))
+            while self.queue and self.queue[0] >> REMINDERS_SCHEDULER_SLOT_BITS <= timestamp:
+                slot = heapq.heappop(self.queue) & REMINDERS_SCHEDULER_SLOT_MASK
+                id = self.ids[slot]
+                self.free_slots.append(slot)
+                
+                if id == -1:
+                    self.stale_count -= 1
+                    continue
+                
+                del self.slots[id]
+                self.ids[slot] = -1
+                due.append((self.chat_ids[slot], id, self.dates[slot]))
         
-        return Reminder(id, date, text, active)
-    
-    return list(map(row_to_reminder, result))
-
-@dp.message(CommandStart())
-async def command_start_handler(message: Message) -> None:
-    await asyncio.to_thread(create_reminders_db, message.chat.id)
-    await message.answer(START_MESSAGE)
-
-@dp.message(Command(WEATHER_COMMAND))
-async def command_weather_handler(message: Message, command: CommandObject) -> None:
-    if command.args is None or command.args.isspace():
-        await message.answer("Вы не указали город.\nПример использования: /weather Санкт-Петербург")
-        return
+        return due
     
-    try:
-        observation = mgr.weather_at_place(command.args)
-    except OwmNotFoundError:
-        await message.answer("Город не найден :(")
-        return
+    def next_due(self) -> int | None:
+        with self.lock:
+            while self.queue:
+                key = self.queue[0]
+                slot = key & REMINDERS_SCHEDULER_SLOT_MASK
+                if self.ids[slot] != -1:
+                    return key >> REMINDERS_SCHEDULER_SLOT_BITS
+                
+                heapq.heappop(self.queue)
+                self.free_slots.append(slot)
+                self.stale_count -= 1
+        
+        return None
     
-    w: Weather = observation.weather
-    l: Location = observation.location
+    def notify(self) -> None:
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
     
-    detailed_status: str = w.detailed_status
-    country_name = COUNTRY_CODE_TO_COUNTRY_NAME[l.country]
-    temperature = w.temperature(unit="celsius")
-    temp = int(round(temperature["temp"]))
-    temp_max = int(round(temperature["temp_max"]))
-    temp_min = int(round(temperature["temp_min"]))
-    feels_like = int(round(temperature["feels_like"]))
-    humidity = w.humidity
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        
+        while True:
+            self.wakeup.clear()
+            
+            try:
+                await check_reminders_expiration()
+            except Exception:
+                logging.exception("Failed to dispatch due reminders")
+            
+            timeout = REMINDERS_SCHEDULER_MAX_SLEEP
+            next_date = self.next_due()
+            if next_date is not None:
+                timeout = min(timeout, max(0, next_date - get_current_timestamp()))
+            
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+
+reminder_scheduler = ReminderScheduler()
+
+def escape_metric_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_metric_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
     
-    wind = w.wind()
-    wind_speed = wind["speed"]
+    return "{" + ",".join(f'{name}="{escape_metric_label(value)}"' for name, value in zip(names, values)) + "}"
+
+class Metric:
+    type = "untyped"
     
-    flag = COUNTRY_CODE_TO_FLAG[l.country]
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
     
-    await message.answer(f"Место: <b>{l.name}, {country_name} {flag}</b>\nПогода: <b>{detailed_status.capitalize()}</b>\nТемпература: <b>{temp} °C</b>\nМакс. температура: <b>{temp_max} °C</b>\nМин. температура: <b>{temp_min} °C</b>\nОщущается как: <b>{feels_like} °C</b>\nВлажность: <b>{humidity}%</b>\nВетер: <b>{wind_speed} м/c</b>")
-
-def get_current_reminders_text(reminders: list[Reminder]) -> str | None:
-    if len(reminders) == 0:
-        return None
+    def render_samples(self) -> list[str]:
+        return []
     
-    text = "Список напоминаний:\n"
-    for i, reminder in enumerate(reminders, start=1):
-        date = datetime.fromtimestamp(reminder.date, UTC).strftime("%H:%M, %d/%m/%Y")
-        status = '\u231B' if reminder.active else '\u2705'
-        text += f"{i}. {status} [{date}] {reminder.text}\n\n"
-    return text
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self.render_samples()]
 
-@dp.message(Command(REMINDERS_COMMAND))
-async def command_reminders_handler(message: Message) -> None:
-    reminders = await asyncio.to_thread(get_reminders, message.chat.id)
-    if len(reminders) == 0:
-        await message.answer("У вас нет напоминаний.")
-        return
+class MetricCounter(Metric):
+    type = "counter"
     
-    text = get_current_reminders_text(reminders)
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
     
-    completed_present = any(not reminder.active for reminder in reminders)
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
     
-    reply_markup = None
-    if completed_present:
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="Удалить завершённые напоминания", callback_data=ReminderCallback(action=ReminderAction.DELETE_COMPLETED).pack())
-        reply_markup = keyboard.as_markup()
-    
-    await message.answer(text, reply_markup=reply_markup)
+    def render_samples(self) -> list[str]:
+        with self.lock:
+            values = list(self.values.items())
+        
+        return [f"{self.name}{format_metric_labels(self.labels, labels)} {value}" for labels, value in values]
 
-def delete_completed_reminders(chat_id: int) -> int:
-    database_file = f"./databases/{chat_id}.db"
-    
-    reminders = REMINDERS[chat_id]
+@dataclass(slots=True)
+class HistogramSeries:
+    counts: list[int]
+    total: float = 0.0
+
+class MetricHistogram(Metric):
+    type = "histogram"
     
-    deleted_count = 0
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = METRICS_LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], HistogramSeries] = {}
     
-    with sqlite3.connect(database_file) as conn:
-        for i in reversed(range(len(reminders))):
-            reminder = reminders[i]
-            if reminder.active: continue
-            del reminders[i]
-            
-            conn.execute("DELETE FROM Reminders WHERE id = ?", (reminder.id,))
-            deleted_count += 1
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = HistogramSeries([0] * (len(self.buckets) + 1))
             
-        conn.commit()
+            series.counts[index] += 1
+            series.total += value
+    
+    @contextmanager
+    def measure(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+    
+    def render_samples(self) -> list[str]:
+        with self.lock:
+            series = [(labels, list(item.counts), item.total) for labels, item in self.series.items()]
         
-    return deleted_count
+        lines = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_metric_labels((*self.labels, 'le'), (*labels, str(bound)))} {cumulative}")
+            
+            lines.append(f"{self.name}_sum{format_metric_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_metric_labels(self.labels, labels)} {cumulative}")
         
+        return lines
 
-@dp.callback_query(ReminderCallback.filter(F.action == ReminderAction.DELETE_COMPLETED))
-async def handle_delete_completed_reminders(query: CallbackQuery, callback_data: ReminderCallback, bot: Bot) -> None:
-    action = callback_data.action
+class MetricGauge(Metric):
+    def __init__(self, name: str, help: str, collect: Callable[[], float], type: str = "gauge") -> None:
+        super().__init__(name, help)
+        self.collect = collect
+        self.type = type
     
-    chat_id = query.from_user.id
+    def render_samples(self) -> list[str]:
+        return [f"{self.name} {self.collect()}"]
+
+MetricType = TypeVar("MetricType", bound=Metric)
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
     
-    if action == ReminderAction.DELETE_COMPLETED:
-        reminders = REMINDERS[chat_id]
+    def register(self, metric: MetricType) -> MetricType:
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.exception("Failed to render metric %s", metric.name)
         
-        if len(reminders) > 0:
-            deleted_count = await asyncio.to_thread(delete_completed_reminders, chat_id)
-            
-            word = get_word_case(deleted_count, ("неактивное напоминание", "неактивных напоминания", "неактивных напоминаний"))
-            
-            new_text = f"Вы успешно удалили {deleted_count} {word}.\n"
-            
-            reminders_text = get_current_reminders_text(reminders)
-            
-            new_text += reminders_text if reminders_text else "На данный момент у вас нет напоминаний."
-            
-            await query.message.delete_reply_markup()
-            await query.message.edit_text(new_text)
-        else:
-            await query.message.answer(f"У вас пока нет завершённых напоминаний.")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+handler_latency = metrics.register(MetricHistogram("bot_handler_duration_seconds", "Time spent in update handlers", ("handler",)))
+handler_errors = metrics.register(MetricCounter("bot_handler_errors_total", "Exceptions raised by update handlers", ("handler",)))
+telegram_latency = metrics.register(MetricHistogram("bot_telegram_request_duration_seconds", "Telegram Bot API call latency", ("method",)))
+telegram_requests = metrics.register(MetricCounter("bot_telegram_requests_total", "Telegram Bot API calls by outcome", ("method", "result")))
+owm_latency = metrics.register(MetricHistogram("bot_owm_request_duration_seconds", "OpenWeatherMap request latency", ("endpoint",)))
+owm_requests = metrics.register(MetricCounter("bot_owm_requests_total", "OpenWeatherMap requests by HTTP status or failure", ("endpoint", "result")))
+owm_retries = metrics.register(MetricCounter("bot_owm_retries_total", "OpenWeatherMap requests retried, or not retried because the retry budget ran out", ("endpoint", "result")))
+database_latency = metrics.register(MetricHistogram("bot_db_statement_duration_seconds", "SQLite statement execution time", ("database", "statement"), METRICS_DATABASE_BUCKETS))
+reminder_lag = metrics.register(MetricHistogram("bot_reminder_lag_seconds", "Delay between a reminder's due time and its delivery", buckets=METRICS_LAG_BUCKETS))
+reminder_deliveries = metrics.register(MetricCounter("bot_reminder_deliveries_total", "Reminder delivery attempts by outcome", ("result",)))
+
+statement_labels: dict[str, str] = {}
+
+def get_statement_label(sql: str) -> str:
+    label = statement_labels.get(sql)
+    if label is None:
+        words = sql.split(maxsplit=1)
+        verb = words[0].upper() if words else ""
+        table = SQL_TABLE_PATTERN.search(sql)
+        label = f"{verb} {table.group(1)}" if table is not None else verb
+        statement_labels[sql] = label
     
-    await query.answer()
+    return label
 
-@reminder_router.message(Command(CANCEL_COMMAND))
-@reminder_router.message(F.text.casefold() == "cancel")
-async def new_reminder_cancel(message: Message, state: FSMContext) -> None:
-    current_state = await state.get_state()
-    if current_state is None:
-        await message.answer("Нечего отменять.", reply_markup=ReplyKeyboardRemove())
-        return
+def get_database_label(database: str) -> str:
+    return os.path.splitext(os.path.basename(database.removeprefix("file:").split("?")[0]))[0]
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql: str, parameters: Any = (), /) -> Self:
+        with database_latency.measure(self.connection.label, get_statement_label(sql)):
+            return super().execute(sql, parameters)
     
-    await state.clear()
-    await message.answer("Создание напоминания отменено.", reply_markup=ReplyKeyboardRemove())
+    def executemany(self, sql: str, parameters: Any, /) -> Self:
+        with database_latency.measure(self.connection.label, get_statement_label(sql)):
+            return super().executemany(sql, parameters)
 
-@reminder_router.message(Command(REMINDER_COMMAND))
-async def command_new_reminder_handler(message: Message, state: FSMContext) -> None:
-    current_state = await state.get_state()
-    if current_state is not None:
-        await state.clear()
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, database: str, *args: Any, **kwargs: Any) -> None:
+        super().__init__(database, *args, **kwargs)
+        self.label = get_database_label(database)
     
-    await state.set_state(NewReminderState.text)
-    await message.answer("Введите текст напоминания", reply_markup=ReplyKeyboardRemove())
+    def cursor(self, factory: type[sqlite3.Cursor] = InstrumentedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
     
-@reminder_router.message(NewReminderState.text)
-async def new_reminder_text(message: Message, state: FSMContext) -> None:
-    await state.update_data(text=message.text)
-    await state.set_state(NewReminderState.date)
-    await message.answer("Теперь введите время и дату напоминания в формате: <b>ЧЧ:ММ ДД/ММ/ГГГГ</b>\n\nПримечание:\n<i>Дата не обязательна, по умолчанию - текущий день</i>")
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql: str, parameters: Any, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, parameters)
 
-@reminder_router.message(NewReminderState.date)
-async def new_reminder_date(message: Message, state: FSMContext) -> None:
-    example_date = "10:20 23/12/2025"
+class SQLitePool:
+    def __init__(self, database: str, max_idle: int, idle_timeout: float) -> None:
+        self.database = database
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle: list[tuple[sqlite3.Connection, float]] = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
     
-    date_time = message.text.split(" ")
-    if len(date_time) == 0:
-        await message.answer(f"Вы указали время и дату неправильно.\nПример: <b>{example_date}</b>")
-        return
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database, check_same_thread=False, cached_statements=REMINDERS_DATABASE_CACHED_STATEMENTS, factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={REMINDERS_DATABASE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
     
-    t = date_time[0].split(":")
-    if len(t) != 2:
-        await message.answer(f"Вы указали время неправильно.\nПример: <b>{example_date}</b>")
-        return
+    def acquire(self) -> sqlite3.Connection:
+        with self.lock:
+            self.evict_expired()
+            if self.idle:
+                self.hits += 1
+                conn, _ = self.idle.pop()
+                return conn
+            
+            self.misses += 1
+        
+        return self.connect()
     
-    try:
-        hours = int(t[0])
-    except ValueError:
-        await message.answer(f"Вы указали время неправильно.\nПример: <b>{example_date}</b>")
-        return
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
+            while len(self.idle) > self.max_idle:
+                oldest, _ = self.idle.pop(0)
+                oldest.close()
+                self.evictions += 1
     
-    if hours >= 24:
-        await message.answer(f"Час должен быть меньше 24.\nПример: <b>{example_date}</b>")
-        return
+    def evict_expired(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        while self.idle and self.idle[0][1] < deadline:
+            oldest, _ = self.idle.pop(0)
+            oldest.close()
+            self.evictions += 1
     
-    if hours < 0:
-        await message.answer(f"Час должен быть больше или равен нулю.\nПример: <b>{example_date}</b>")
-        return
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
     
-    try:
-        minutes = int(t[1])
-    except ValueError:
-        await message.answer(f"Вы указали время неправильно.\nПример: <b>{example_date}</b>")
-        return
+    def get_stats(self) -> dict[str, float]:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle": len(self.idle),
+                "hit_rate": self.hits / requests if requests else 0.0
+            }
     
-    if minutes >= 60:
-        await message.answer(f"Минуты должны быть меньше 60.\nПример: <b>{example_date}</b>")
-        return
+    def close(self) -> None:
+        with self.lock:
+            for conn, _ in self.idle:
+                conn.close()
+            self.idle.clear()
+
+reminders_pool = SQLitePool(REMINDERS_DATABASE, REMINDERS_DATABASE_POOL_SIZE, REMINDERS_DATABASE_IDLE_TIMEOUT)
+
+@dataclass
+class WriteOperation:
+    sql: str
+    params: list[tuple[Any, ...]]
+    future: asyncio.Future
+
+class ReminderWriter:
+    def __init__(self, database: str) -> None:
+        self.database = database
+        self.queue: asyncio.Queue[WriteOperation | None] = asyncio.Queue()
+        self.conn: sqlite3.Connection | None = None
+        self.batches = 0
+        self.operations = 0
     
-    if minutes < 0:
-        await message.answer(f"Минуты должны быть больше или равны нулю.\nПример: <b>{example_date}</b>")
-        return
+    async def execute(self, sql: str, params: list[tuple[Any, ...]]) -> list[int] | int:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(WriteOperation(sql, params, future))
+        return await future
     
-    today = datetime.today()
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None, cached_statements=REMINDERS_DATABASE_CACHED_STATEMENTS, factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
     
-    day = today.day
-    month = today.month
-    year = today.year
+    def write_operation(self, conn: sqlite3.Connection, operation: WriteOperation) -> list[int] | int:
+        if not operation.sql.startswith("INSERT"):
+            return conn.executemany(operation.sql, operation.params).rowcount
+        
+        return [conn.execute(operation.sql, params).lastrowid for params in operation.params]
     
-    if len(date_time) > 1:
-        d = date_time[1].split('/')
-        if len(d) != 3:
-            await message.answer(f"Вы указали дату неправильно.\nПример: <b>{example_date}</b>")
-            return
-
-        try:
-            day = int(d[0])
-        except ValueError:
-            await message.answer(f"Вы указали дату неправильно.\nПример: <b>{example_date}</b>")
-            return
+    def write_batch(self, batch: list[WriteOperation]) -> list[list[int] | int | sqlite3.Error]:
+        if self.conn is None:
+            self.conn = self.connect()
         
-        if day < 0:
-            await message.answer(f"День не может быть меньше <b>нуля</b>.\nПример: <b>{example_date}</b>")
-            return
+        conn = self.conn
+        results: list[list[int] | int | sqlite3.Error] = []
         
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            month = int(d[1])
-        except ValueError:
-            await message.answer(f"Вы указали дату неправильно.\nПример: <b>{example_date}</b>")
-            return
+            for operation in batch:
+                conn.execute("SAVEPOINT operation")
+                try:
+                    results.append(self.write_operation(conn, operation))
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO operation")
+                    results.append(e)
+                conn.execute("RELEASE operation")
+            
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
         
-        if not 1 <= month <= 12:
-            await message.answer(f"Месяц должен быть в диапазоне от <b>1</b> до <b>12</b>.\nПример: <b>{example_date}</b>")
+        return results
+    
+    async def collect_batch(self, first: WriteOperation) -> tuple[list[WriteOperation], bool]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REMINDERS_WRITER_BATCH_DELAY
+        batch = [first]
+        
+        while len(batch) < REMINDERS_WRITER_BATCH_SIZE:
+            try:
+                operation = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                
+                try:
+                    operation = await asyncio.wait_for(self.queue.get(), timeout)
+                except TimeoutError:
+                    break
+            
+            if operation is None:
+                return batch, True
+            
+            batch.append(operation)
+        
+        return batch, False
+    
+    async def run(self) -> None:
+        closing = False
+        
+        while not closing:
+            first = await self.queue.get()
+            if first is None:
+                break
+            
+            batch, closing = await self.collect_batch(first)
+            
+            try:
+                results = await asyncio.to_thread(self.write_batch, batch)
+            except Exception as e:
+                logging.exception("Failed to write a batch of %d reminder operations", len(batch))
+                for operation in batch:
+                    if not operation.future.done():
+                        operation.future.set_exception(e)
+                continue
+            
+            self.batches += 1
+            self.operations += len(batch)
+            
+            for operation, result in zip(batch, results):
+                if operation.future.done():
+                    continue
+                
+                if isinstance(result, sqlite3.Error):
+                    operation.future.set_exception(result)
+                else:
+                    operation.future.set_result(result)
+        
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    
+    def close(self) -> None:
+        self.queue.put_nowait(None)
+
+reminders_writer = ReminderWriter(REMINDERS_DATABASE)
+
+@dataclass(slots=True)
+class FsmRecord:
+    state: str | None
+    data: dict[str, Any]
+    expires_at: float = 0
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl: float = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, FsmRecord] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def get_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.business_connection_id or ''}:{key.destiny}"
+    
+    def read(self, key: str) -> FsmRecord:
+        with reminders_pool.connection() as conn:
+            row = conn.execute("SELECT state, data, expires_at FROM FsmStates WHERE key = ?", (key,)).fetchone()
+        
+        if row is None:
+            return FsmRecord(None, {})
+        
+        state, data, expires_at = row
+        return FsmRecord(state, json.loads(data), expires_at)
+    
+    def remember(self, key: str, record: FsmRecord) -> None:
+        self.cache[key] = record
+        self.cache.move_to_end(key)
+        
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+    
+    async def load(self, key: str) -> FsmRecord:
+        record = self.cache.get(key)
+        if record is None:
+            self.misses += 1
+            record = await asyncio.to_thread(self.read, key)
+        else:
+            self.hits += 1
+        
+        if record.expires_at and record.expires_at < time.time():
+            record = FsmRecord(None, {})
+        
+        self.remember(key, record)
+        return record
+    
+    async def store(self, key: str, state: str | None, data: dict[str, Any]) -> None:
+        if state is None and not data:
+            self.remember(key, FsmRecord(None, {}))
+            await reminders_writer.execute("DELETE FROM FsmStates WHERE key = ?", [(key,)])
+            return
+        
+        record = FsmRecord(state, data, time.time() + self.ttl)
+        self.remember(key, record)
+        await reminders_writer.execute(
+            "REPLACE INTO FsmStates (key, state, data, expires_at) VALUES (?, ?, ?, ?)",
+            [(key, state, json.dumps(data, ensure_ascii=False), record.expires_at)]
+        )
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.get_key(key)
+        record = await self.load(storage_key)
+        await self.store(storage_key, state.state if isinstance(state, State) else state, record.data)
+    
+    async def get_state(self, key: StorageKey) -> str | None:
+        record = await self.load(self.get_key(key))
+        return record.state
+    
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.get_key(key)
+        record = await self.load(storage_key)
+        await self.store(storage_key, record.state, dict(data))
+    
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        record = await self.load(self.get_key(key))
+        return record.data.copy()
+    
+    async def purge(self) -> int:
+        self.cache = OrderedDict((key, record) for key, record in self.cache.items() if not record.expires_at or record.expires_at >= time.time())
+        return await reminders_writer.execute("DELETE FROM FsmStates WHERE expires_at < ?", [(time.time(),)])
+    
+    def get_stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "cached": len(self.cache),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+    
+    async def close(self) -> None:
+        self.cache.clear()
+
+fsm_storage = SQLiteStorage()
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+    
+    def pause(self, seconds: float) -> None:
+        self.refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+    
+    def get_delay(self) -> float:
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+    
+    def take(self) -> None:
+        self.refill()
+        self.tokens -= 1
+    
+    async def acquire(self) -> None:
+        self.take()
+        
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+@dataclass
+class Delivery:
+    chat_id: int
+    text: str
+    due: float
+    reminder_id: int | None = None
+    is_rule: bool = False
+    attempt: int = 0
+
+class ReminderDelivery:
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[int] = asyncio.Queue()
+        self.lanes: dict[int, deque[Delivery]] = {}
+        self.global_bucket = TokenBucket(DELIVERY_GLOBAL_RATE, DELIVERY_GLOBAL_RATE)
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.delivered_rules: list[tuple[int, int]] = []
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+    
+    def submit(self, chat_id: int, text: str, due: float, reminder_id: int | None = None, is_rule: bool = False) -> None:
+        self.pending += 1
+        self.idle.clear()
+        delivery = Delivery(chat_id, text, due, reminder_id, is_rule)
+        lane = self.lanes.get(chat_id)
+        if lane is not None:
+            lane.append(delivery)
+            return
+        
+        self.lanes[chat_id] = deque([delivery])
+        self.schedule(chat_id)
+    
+    def get_earliest_due(self) -> float | None:
+        return min((delivery.due for lane in self.lanes.values() for delivery in lane if delivery.reminder_id is not None and not delivery.is_rule), default=None)
+    
+    def take_delivered_rules(self) -> list[tuple[int, int]]:
+        rules, self.delivered_rules = self.delivered_rules, []
+        return rules
+    
+    def schedule(self, chat_id: int, delay: float = 0.0) -> None:
+        delay = max(delay, self.get_chat_bucket(chat_id).get_delay())
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, chat_id)
+        else:
+            self.queue.put_nowait(chat_id)
+    
+    def compact(self) -> None:
+        self.chat_buckets = {id: bucket for id, bucket in self.chat_buckets.items() if not bucket.is_full() or id in self.lanes}
+    
+    def get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= DELIVERY_MAX_CHAT_BUCKETS:
+                self.compact()
+            
+            bucket = TokenBucket(DELIVERY_CHAT_RATE, 1)
+            self.chat_buckets[chat_id] = bucket
+        
+        return bucket
+    
+    async def deliver(self, bot: Bot, delivery: Delivery) -> float | None:
+        self.get_chat_bucket(delivery.chat_id).take()
+        await self.global_bucket.acquire()
+            
+        started = time.perf_counter()
+        try:
+            await bot.send_message(delivery.chat_id, delivery.text)
+        except TelegramRetryAfter as e:
+            logging.warning("Flood control while delivering to chat %d, retrying in %d s", delivery.chat_id, e.retry_after)
+            self.global_bucket.pause(e.retry_after)
+            return 0.0
+        except (TelegramNetworkError, TelegramServerError) as e:
+            delay = DELIVERY_RETRY_DELAY * 2 ** delivery.attempt * random.uniform(0.5, 1.5)
+            logging.warning("Failed to deliver to chat %d (%s), retrying in %.1f s", delivery.chat_id, e, delay)
+            return delay
+        except TelegramAPIError as e:
+            logging.warning("Failed to deliver to chat %d: %s", delivery.chat_id, e)
+            self.failed += 1
+            reminder_deliveries.inc("failed")
+            return None
+            
+        latency = time.perf_counter() - started
+        lag = get_current_timestamp() - delivery.due
+            
+        self.sent += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        reminder_lag.observe(lag)
+        reminder_deliveries.inc("sent")
+        return None
+    
+    async def worker(self, bot: Bot) -> None:
+        while True:
+            chat_id = await self.queue.get()
+            lane = self.lanes[chat_id]
+            delivery = lane[0]
+            try:
+                delay = await self.deliver(bot, delivery)
+            except Exception:
+                self.failed += 1
+                reminder_deliveries.inc("failed")
+                logging.exception("Failed to deliver to chat %d", chat_id)
+                delay = None
+            
+            if delay is not None:
+                delivery.attempt += 1
+                if delivery.attempt < DELIVERY_MAX_ATTEMPTS:
+                    self.retries += 1
+                    reminder_deliveries.inc("retried")
+                else:
+                    self.failed += 1
+                    reminder_deliveries.inc("failed")
+                    delay = None
+            
+            if delay is None:
+                lane.popleft()
+                self.pending -= 1
+                if not self.pending:
+                    self.idle.set()
+                
+                if delivery.is_rule:
+                    self.delivered_rules.append((chat_id, delivery.reminder_id))
+                    reminder_scheduler.notify()
+            
+            if lane:
+                self.schedule(chat_id, delay or 0.0)
+            else:
+                del self.lanes[chat_id]
+            self.queue.task_done()
+    
+    async def run(self, bot: Bot) -> None:
+        await asyncio.gather(*(self.worker(bot) for _ in range(DELIVERY_WORKERS)))
+    
+    async def drain(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except TimeoutError:
+            logging.warning("Stopped waiting for %d queued deliveries after %d s", self.pending, timeout)
+    
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "queue_depth": self.pending,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+            "lag_avg": self.lag_total / self.sent if self.sent else 0.0,
+            "lag_max": self.lag_max
+        }
+
+reminder_delivery = ReminderDelivery()
+
+WEATHER_COMMAND = BotCommand(command="weather", description="Получить прогноз погоды")
+RPS_COMMAND = BotCommand(command="rps", description="Сыграть в камень, ножницы, бумага")
+REMINDERS_COMMAND = BotCommand(command="reminders", description="Получить список всех напоминаний")
+REMINDER_COMMAND = BotCommand(command="reminder", description="Создать напоминание")
+REPEAT_COMMAND = BotCommand(command="repeat", description="Создать повторяющееся напоминание")
+IMPORT_COMMAND = BotCommand(command="import", description="Загрузить напоминания из CSV или iCalendar")
+EXPORT_COMMAND = BotCommand(command="export", description="Выгрузить напоминания в CSV или iCalendar")
+SUBSCRIBE_COMMAND = BotCommand(command="subscribe", description="Получать погоду каждый день")
+UNSUBSCRIBE_COMMAND = BotCommand(command="unsubscribe", description="Показать и отменить подписки на погоду")
+CANCEL_COMMAND = BotCommand(command="cancel", description="Отменить текущее действие")
+
+ALL_COMMANDS = [
+    WEATHER_COMMAND,
+    RPS_COMMAND,
+    REMINDERS_COMMAND,
+    REMINDER_COMMAND,
+    REPEAT_COMMAND,
+    IMPORT_COMMAND,
+    EXPORT_COMMAND,
+    SUBSCRIBE_COMMAND,
+    UNSUBSCRIBE_COMMAND,
+    CANCEL_COMMAND
+]
+
+START_MESSAGE = """
+Здравствуйте!
+
+Я бот, созданный при выполнении задания ВСР 2.5 по учебной практике 1 курса в РГПУ им. Герцена.
+
+Мои возможности:
+    - Показывать текущую погоду в любом городе мира с помощью команды /weather
+    - Играть в камень, ножницы, бумага с помощью команды /rps
+    - Создавать напоминания с помощью команды /reminder
+    - Создавать повторяющиеся напоминания с помощью команды /repeat
+    - Загружать и выгружать напоминания в CSV или iCalendar с помощью команд /import и /export
+    - Присылать погоду каждый день в выбранное время с помощью команды /subscribe
+    
+Остальные команды:
+    /cancel - Отменить текущее действие (Например создание напоминания)
+    /reminders - Показать список всех напоминаний
+    /unsubscribe - Показать подписки на погоду и отменить их
+"""
+
+IMPORT_PROMPT = """Отправьте файл с напоминаниями в формате CSV или iCalendar (.ics).
+
+В CSV каждая строка - <b>дата, текст, повторение</b>, например:
+<code>10:20 23/12/2025,Позвонить маме,ежедневно</code>
+Повторение можно не указывать. Файл, полученный командой /export, подходит без изменений."""
+
+class OwmError(Exception):
+    pass
+
+class OwmNotFoundError(OwmError):
+    pass
+
+class OwmRequestError(OwmError):
+    pass
+
+class OwmTimeoutError(OwmRequestError):
+    pass
+
+class OwmResponseError(OwmError):
+    pass
+
+class OwmUnauthorizedError(OwmResponseError):
+    pass
+
+class OwmServerError(OwmResponseError):
+    pass
+
+class OwmBadGatewayError(OwmServerError):
+    pass
+
+class OwmCircuitOpenError(OwmRequestError):
+    pass
+
+def parse_observation(data: dict[str, Any], received_at: float | None = None) -> "Observation":
+    from pyowm.weatherapi25.observation import Observation
+    observation = Observation.from_dict(data)
+    if received_at is not None:
+        observation.rec_time = int(received_at)
+    return observation
+
+class OwmWeatherBackend:
+    def __init__(self, token: str, base_url: str = OWM_API_URL) -> None:
+        self.token = token
+        self.base_url = base_url
+        self.session: aiohttp.ClientSession | None = None
+        self.semaphore = asyncio.Semaphore(WEATHER_MAX_CONCURRENCY)
+    
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=WEATHER_MAX_CONNECTIONS, keepalive_timeout=WEATHER_KEEPALIVE_TIMEOUT, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=OWM_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        
+        return self.session
+    
+    async def get(self, endpoint: str, params: dict[str, Any]) -> dict[str, Any]:
+        params = params | {"appid": self.token, "lang": OWM_LANGUAGE}
+        
+        async with self.semaphore:
+            with owm_latency.measure(endpoint):
+                try:
+                    async with self.get_session().get(f"{self.base_url}/{endpoint}", params=params) as response:
+                        status = response.status
+                        data = await response.json(content_type=None)
+                except asyncio.TimeoutError as e:
+                    owm_requests.inc(endpoint, "timeout")
+                    raise OwmTimeoutError(f"OWM request to {endpoint} timed out") from e
+                except (aiohttp.ClientError, ValueError) as e:
+                    owm_requests.inc(endpoint, "error")
+                    raise OwmRequestError(f"OWM request to {endpoint} failed: {e}") from e
+        
+        owm_requests.inc(endpoint, str(status))
+        
+        match status:
+            case 200: return data
+            case 404: raise OwmNotFoundError(f"OWM has no data for {params.get('q', params.get('id'))}")
+            case 401: raise OwmUnauthorizedError("OWM rejected the API key")
+            case 502: raise OwmBadGatewayError("OWM returned 502")
+            case _ if status >= 500: raise OwmServerError(f"OWM returned {status}: {data}")
+            case _: raise OwmResponseError(f"OWM returned {status}: {data}")
+    
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+class CircuitState(Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int, cooldown: float) -> None:
+        self.name = name
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.state = CircuitState.CLOSED
+        self.changed_at = time.monotonic()
+        self.failures = 0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+    
+    def set_state(self, state: CircuitState) -> None:
+        logging.warning("%s circuit %s -> %s after %.1f s", self.name, self.state.name.lower(), state.name.lower(), time.monotonic() - self.changed_at)
+        self.state = state
+        self.changed_at = time.monotonic()
+    
+    def allow(self) -> bool:
+        if self.state is CircuitState.OPEN:
+            if time.monotonic() - self.changed_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.set_state(CircuitState.HALF_OPEN)
+        
+        if self.state is CircuitState.HALF_OPEN:
+            if self.probing:
+                self.rejected += 1
+                return False
+            self.probing = True
+        
+        return True
+    
+    def release(self) -> None:
+        self.probing = False
+    
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state is not CircuitState.CLOSED:
+            self.set_state(CircuitState.CLOSED)
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state is CircuitState.HALF_OPEN or self.state is CircuitState.CLOSED and self.failures >= self.max_failures:
+            self.opened += 1
+            self.set_state(CircuitState.OPEN)
+    
+    def get_retry_after(self) -> float:
+        if self.state is not CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.changed_at))
+    
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "state": self.state.name.lower(),
+            "state_seconds": time.monotonic() - self.changed_at,
+            "retry_after": self.get_retry_after(),
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+class RetryBudget:
+    def __init__(self, ratio: float, reserve: int) -> None:
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+        self.retries = 0
+        self.exhausted = 0
+    
+    def deposit(self) -> None:
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+    
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+class ResilientWeatherBackend:
+    def __init__(self, backend: "OwmWeatherBackend | LocalWeatherBackend", deadline: float = OWM_DEADLINE, max_attempts: int = OWM_MAX_ATTEMPTS) -> None:
+        self.backend = backend
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker("OWM", OWM_BREAKER_FAILURES, OWM_BREAKER_COOLDOWN)
+        self.budget = RetryBudget(OWM_RETRY_BUDGET_RATIO, OWM_RETRY_BUDGET_RESERVE)
+    
+    async def attempt(self, endpoint: str, params: dict[str, Any], deadline: float) -> dict[str, Any]:
+        if not self.breaker.allow():
+            owm_requests.inc(endpoint, "rejected")
+            raise OwmCircuitOpenError(f"OWM circuit is open, retrying in {self.breaker.get_retry_after():.0f} s")
+        
+        try:
+            async with asyncio.timeout_at(deadline):
+                data = await self.backend.get(endpoint, params)
+        except TimeoutError as e:
+            self.breaker.record_failure()
+            owm_requests.inc(endpoint, "deadline")
+            raise OwmTimeoutError(f"OWM request to {endpoint} missed the {self.deadline} s deadline") from e
+        except (OwmRequestError, OwmServerError):
+            self.breaker.record_failure()
+            raise
+        except OwmError:
+            self.breaker.record_success()
+            raise
+        finally:
+            self.breaker.release()
+        
+        self.breaker.record_success()
+        return data
+    
+    async def get(self, endpoint: str, params: dict[str, Any]) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        self.budget.deposit()
+        
+        for attempt in itertools.count(1):
+            try:
+                return await self.attempt(endpoint, params, deadline)
+            except OwmCircuitOpenError:
+                raise
+            except (OwmRequestError, OwmServerError) as e:
+                delay = OWM_RETRY_DELAY * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if attempt >= self.max_attempts or loop.time() + delay >= deadline:
+                    raise
+                if not self.budget.withdraw():
+                    owm_retries.inc(endpoint, "exhausted")
+                    raise
+                
+                logging.warning("OWM request to %s failed (%s), retrying in %.1f s", endpoint, e, delay)
+                owm_retries.inc(endpoint, "retried")
+                await asyncio.sleep(delay)
+    
+    def get_stats(self) -> dict[str, Any]:
+        return self.breaker.get_stats() | {"retries": self.budget.retries, "retries_exhausted": self.budget.exhausted, "retry_tokens": self.budget.tokens}
+    
+    async def close(self) -> None:
+        await self.backend.close()
+
+class LocalWeatherBackend:
+    def __init__(self, observations: dict[str, dict[str, Any]], delay: float = 0) -> None:
+        self.observations = {name.casefold(): data for name, data in observations.items()}
+        self.delay = delay
+    
+    async def get(self, endpoint: str, params: dict[str, Any]) -> dict[str, Any]:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        
+        if endpoint == "group":
+            observations = [self.observations[id] for id in params["id"].split(",") if id in self.observations]
+            return {"cnt": len(observations), "list": observations}
+        
+        data = self.observations.get(str(params.get("q", params.get("id"))).casefold())
+        if data is None:
+            raise OwmNotFoundError(f"No local data for {params}")
+        
+        return data
+    
+    async def close(self) -> None:
+        pass
+
+def normalize_place_name(name: str) -> str:
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+def read_weather_cache(since: float, limit: int) -> tuple[list[tuple[float, "Observation"]], list[tuple[str, int]]]:
+    with reminders_pool.connection() as conn:
+        rows = conn.execute("SELECT data, fetched_at FROM WeatherObservations WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?", (since, limit)).fetchall()
+        places = conn.execute(
+            "SELECT name, id FROM WeatherPlaces WHERE id IN (SELECT id FROM WeatherObservations WHERE fetched_at >= ? ORDER BY fetched_at DESC LIMIT ?)",
+            (since, limit)
+        ).fetchall()
+    
+    observations = []
+    for data, fetched_at in rows:
+        try:
+            observations.append((fetched_at, parse_observation(json.loads(data), fetched_at)))
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning("Skipping a broken cached observation - %s: %s", type(e).__name__, e)
+    
+    return observations, places
+
+class WeatherCache:
+    def __init__(self, ttl: float, max_size: int, stale_ttl: float = WEATHER_STALE_TTL, max_stale: float = WEATHER_MAX_STALE, persistent: bool = False) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_ttl = stale_ttl
+        self.max_stale = max_stale
+        self.persistent = persistent
+        self.places: OrderedDict[str, int] = OrderedDict()
+        self.observations: OrderedDict[int, tuple[float, "Observation"]] = OrderedDict()
+        self.inflight: dict[tuple[str, Any], asyncio.Task] = {}
+        self.refreshes: set[asyncio.Task] = set()
+        self.dirty_observations: dict[int, tuple[dict[str, Any], float]] = {}
+        self.dirty_places: dict[str, int] = {}
+        self.purge_before: float | None = None
+        self.flush_lock = asyncio.Lock()
+        self.conn: sqlite3.Connection | None = None
+        self.prefetched: set[int] = set()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.degraded = 0
+        self.loaded = 0
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self.flushes = 0
+    
+    def record_hit(self, id: int) -> None:
+        self.hits += 1
+        if id in self.prefetched:
+            self.prefetched.discard(id)
+            self.prefetch_hits += 1
+    
+    def get_entry(self, id: int) -> tuple[float, "Observation"] | None:
+        entry = self.observations.get(id)
+        if entry is None:
+            return None
+        
+        if time.time() - entry[0] >= self.max_stale:
+            del self.observations[id]
+            return None
+        
+        self.observations.move_to_end(id)
+        return entry
+    
+    def get(self, id: int) -> "Observation | None":
+        entry = self.get_entry(id)
+        if entry is None or time.time() - entry[0] >= self.ttl:
+            return None
+        
+        return entry[1]
+    
+    def get_place_id(self, name: str) -> int | None:
+        id = self.places.get(name)
+        if id is not None:
+            self.places.move_to_end(name)
+        return id
+    
+    def put(self, observation: "Observation", data: dict[str, Any], prefetch: bool = False) -> None:
+        id = observation.location.id
+        fetched_at = time.time()
+        
+        self.observations[id] = (fetched_at, observation)
+        self.observations.move_to_end(id)
+        while len(self.observations) > self.max_size:
+            evicted, _ = self.observations.popitem(last=False)
+            self.prefetched.discard(evicted)
+        
+        if prefetch:
+            self.prefetched.add(id)
+        else:
+            self.prefetched.discard(id)
+        
+        if self.persistent:
+            self.dirty_observations[id] = (data, fetched_at)
+    
+    def put_place(self, name: str, id: int) -> None:
+        if self.places.get(name) == id:
+            self.places.move_to_end(name)
+            return
+    
+        self.places[name] = id
+        self.places.move_to_end(name)
+        while len(self.places) > self.max_size:
+            self.places.popitem(last=False)
+        
+        if self.persistent:
+            self.dirty_places[name] = id
+    
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(REMINDERS_DATABASE, check_same_thread=False, isolation_level=None, factory=InstrumentedConnection)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+    
+    def write_batch(self, observations: dict[int, tuple[dict[str, Any], float]], places: dict[str, int], purge_before: float | None) -> None:
+        if self.conn is None:
+            self.conn = self.connect()
+        
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "REPLACE INTO WeatherObservations (id, data, fetched_at) VALUES (?, ?, ?)",
+                [(id, json.dumps(data, ensure_ascii=False), fetched_at) for id, (data, fetched_at) in observations.items()]
+            )
+            conn.executemany("REPLACE INTO WeatherPlaces (name, id) VALUES (?, ?)", places.items())
+            
+            if purge_before is not None:
+                conn.execute("DELETE FROM WeatherObservations WHERE fetched_at < ?", (purge_before,))
+                conn.execute("DELETE FROM WeatherPlaces WHERE id NOT IN (SELECT id FROM WeatherObservations)")
+            
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.dirty_observations and not self.dirty_places and self.purge_before is None:
+                return
+            
+            observations, places, purge_before = self.dirty_observations, self.dirty_places, self.purge_before
+            self.dirty_observations, self.dirty_places, self.purge_before = {}, {}, None
+            
+            try:
+                await asyncio.to_thread(self.write_batch, observations, places, purge_before)
+            except sqlite3.Error as e:
+                logging.warning("Failed to persist the weather cache - %s: %s", type(e).__name__, e)
+                return
+        
+            self.flushes += 1
+    
+    def refresh(self, refresh: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(refresh)
+        self.refreshes.add(task)
+        task.add_done_callback(self.finish_refresh)
+    
+    def finish_refresh(self, task: asyncio.Task) -> None:
+        self.refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            logging.warning("Background weather refresh failed - %s: %s", type(e).__name__, e)
+    
+    async def load(self) -> None:
+        since = time.time() - self.max_stale
+        observations, places = await asyncio.to_thread(read_weather_cache, since, self.max_size)
+        
+        for fetched_at, observation in observations:
+            id = observation.location.id
+            if id not in self.observations:
+                self.observations[id] = (fetched_at, observation)
+                self.observations.move_to_end(id, last=False)
+                self.loaded += 1
+        
+        for name, id in places:
+            if name not in self.places and id in self.observations:
+                self.places[name] = id
+                self.places.move_to_end(name, last=False)
+        
+        while len(self.observations) > self.max_size:
+            self.observations.popitem(last=False)
+        while len(self.places) > self.max_size:
+            self.places.popitem(last=False)
+        
+        self.purge_before = since
+        logging.info("Weather cache: loaded %d observations and %d places from %s", len(observations), len(places), REMINDERS_DATABASE)
+    
+    def start_flight(self, key: tuple[str, Any], fetch: Callable[[], Awaitable["Observation"]], prefetch: bool = False) -> asyncio.Task:
+        task = self.inflight.get(key)
+        if task is None:
+            if prefetch:
+                self.prefetches += 1
+            else:
+                self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self.inflight[key] = task
+            task.add_done_callback(lambda task: self.finish_flight(key, task))
+        else:
+            self.coalesced += 1
+        
+        return task
+    
+    def finish_flight(self, key: tuple[str, Any], task: asyncio.Task) -> None:
+        self.inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+    
+    async def single_flight(self, key: tuple[str, Any], fetch: Callable[[], Awaitable["Observation"]], prefetch: bool = False) -> "Observation":
+        return await asyncio.shield(self.start_flight(key, fetch, prefetch))
+    
+    async def revalidate(self, key: tuple[str, Any], fetch: Callable[[], Awaitable["Observation"]], entry: tuple[float, "Observation"]) -> "Observation":
+        fetched_at, observation = entry
+        age = time.time() - fetched_at
+        if age < self.ttl:
+            self.record_hit(observation.location.id)
+            return observation
+        
+        task = self.start_flight(key, fetch)
+        if age < self.stale_ttl:
+            self.stale += 1
+            return observation
+        
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), WEATHER_STALE_TIMEOUT)
+        except OwmNotFoundError:
+            raise
+        except (OwmError, TimeoutError) as e:
+            logging.warning("Serving weather for %s fetched %.0f s ago - %s: %s", key[1], age, type(e).__name__, e)
+            self.degraded += 1
+            return observation
+    
+    async def close(self) -> None:
+        for task in self.refreshes | set(self.inflight.values()):
+            task.cancel()
+        
+        await asyncio.gather(*self.refreshes, *self.inflight.values(), return_exceptions=True)
+        await self.flush()
+        
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+    
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "stale": self.stale,
+            "degraded": self.degraded,
+            "loaded": self.loaded,
+            "flushes": self.flushes,
+            "prefetches": self.prefetches,
+            "prefetch_hits": self.prefetch_hits,
+            "places": len(self.places),
+            "observations": len(self.observations)
+        }
+
+class AsyncWeatherManager:
+    def __init__(self, backend: ResilientWeatherBackend | OwmWeatherBackend | LocalWeatherBackend, cache: WeatherCache | None = None) -> None:
+        self.backend = backend
+        self.cache = cache if cache is not None else WeatherCache(WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE)
+        self.city_index: CityIndex | None = None
+        self.group_supported = True
+        self.refreshing: set[int] = set()
+        self.prefetcher: WeatherPrefetcher | None = None
+        self.prefetch_calls = 0
+    
+    def record_requests(self, observations: Iterable["Observation | Exception"]) -> None:
+        if self.prefetcher is None:
+            return
+        
+        for observation in observations:
+            if not isinstance(observation, Exception):
+                self.prefetcher.record(observation.location.id)
+    
+    async def weather_at_place(self, name: str) -> "Observation":
+        key = normalize_place_name(name)
+        
+        id = self.cache.get_place_id(key)
+        if id is not None and self.cache.get_entry(id) is not None:
+            return await self.weather_at_id(id)
+        
+        if self.city_index is not None:
+            id = self.city_index.resolve(name)
+            if id is not None:
+                observation = await self.weather_at_id(id)
+                self.cache.put_place(key, id)
+                return observation
+        
+        async def fetch() -> "Observation":
+            data = await self.backend.get("weather", {"q": name})
+            observation = parse_observation(data)
+            self.cache.put(observation, data)
+            self.cache.put_place(key, observation.location.id)
+            return observation
+        
+        return await self.cache.single_flight(("place", key), fetch)
+    
+    async def fetch_id(self, id: int, prefetch: bool = False) -> "Observation":
+        if prefetch:
+            self.prefetch_calls += 1
+        
+        data = await self.backend.get("weather", {"id": id})
+        observation = parse_observation(data)
+        self.cache.put(observation, data, prefetch)
+        return observation
+    
+    async def weather_at_id(self, id: int) -> "Observation":
+        entry = self.cache.get_entry(id)
+        if entry is None:
+            return await self.cache.single_flight(("id", id), lambda: self.fetch_id(id))
+        
+        return await self.cache.revalidate(("id", id), lambda: self.fetch_id(id), entry)
+    
+    async def fetch_group(self, ids: list[int], prefetch: bool = False) -> dict[int, "Observation | Exception"]:
+        if self.group_supported:
+            if prefetch:
+                self.prefetch_calls += 1
+            
+            try:
+                data = await self.backend.get("group", {"id": ",".join(map(str, ids))})
+            except (OwmRequestError, OwmServerError) as e:
+                if prefetch:
+                    logging.warning("OWM group prefetch for %d cities failed: %s", len(ids), e)
+                    return {id: e for id in ids}
+                
+                logging.warning("OWM group request for %d cities failed, falling back to single requests: %s", len(ids), e)
+            except (OwmNotFoundError, OwmResponseError) as e:
+                logging.warning("OWM group requests are unavailable, falling back to single requests: %s", e)
+                self.group_supported = False
+            else:
+                if prefetch:
+                    self.cache.prefetches += len(ids)
+                else:
+                    self.cache.misses += len(ids)
+                
+                results: dict[int, "Observation | Exception"] = {}
+                for item in data.get("list", []):
+                    observation = parse_observation(item)
+                    self.cache.put(observation, item, prefetch)
+                    results[observation.location.id] = observation
+                
+                for id in ids:
+                    results.setdefault(id, OwmNotFoundError(f"OWM has no data for {id}"))
+                return results
+        
+        if prefetch:
+            observations = await asyncio.gather(
+                *(self.cache.single_flight(("id", id), lambda id=id: self.fetch_id(id, prefetch), prefetch) for id in ids),
+                return_exceptions=True
+            )
+        else:
+            observations = await asyncio.gather(*(self.weather_at_id(id) for id in ids), return_exceptions=True)
+        return dict(zip(ids, observations))
+    
+    async def fetch_groups(self, ids: list[int], prefetch: bool = False) -> dict[int, "Observation | Exception"]:
+        results: dict[int, "Observation | Exception"] = {}
+        groups = [ids[i:i + OWM_GROUP_SIZE] for i in range(0, len(ids), OWM_GROUP_SIZE)]
+        for fetched in await asyncio.gather(*(self.fetch_group(group, prefetch) for group in groups)):
+            results.update(fetched)
+        
+        return results
+    
+    async def refresh_ids(self, ids: list[int], prefetch: bool = False) -> dict[int, "Observation | Exception"]:
+        self.refreshing.update(ids)
+        try:
+            if self.group_supported:
+                return await self.fetch_groups(ids, prefetch)
+            
+            observations = await asyncio.gather(
+                *(self.cache.single_flight(("id", id), lambda id=id: self.fetch_id(id, prefetch), prefetch) for id in ids),
+                return_exceptions=True
+            )
+            return dict(zip(ids, observations))
+        finally:
+            self.refreshing.difference_update(ids)
+    
+    async def weather_at_ids(self, ids: list[int]) -> dict[int, "Observation | Exception"]:
+        results: dict[int, "Observation | Exception"] = {}
+        missing = []
+        stale = []
+        fallbacks: dict[int, "Observation"] = {}
+        now = time.time()
+        
+        for id in ids:
+            entry = self.cache.get_entry(id)
+            if entry is None:
+                missing.append(id)
+                continue
+            
+            fetched_at, observation = entry
+            if now - fetched_at < self.cache.ttl:
+                self.cache.record_hit(id)
+                results[id] = observation
+            elif now - fetched_at < self.cache.stale_ttl:
+                self.cache.stale += 1
+                results[id] = observation
+                if id not in self.refreshing:
+                    stale.append(id)
+            else:
+                missing.append(id)
+                fallbacks[id] = observation
+        
+        if stale:
+            self.cache.refresh(self.refresh_ids(stale))
+        if not missing:
+            return results
+        
+        task = asyncio.ensure_future(self.fetch_groups(missing))
+        try:
+            fetched = await asyncio.wait_for(asyncio.shield(task), WEATHER_STALE_TIMEOUT if len(fallbacks) == len(missing) else None)
+        except TimeoutError:
+            self.cache.refresh(task)
+            fetched = {}
+        
+        for id in missing:
+            observation = fetched.get(id)
+            if id in fallbacks and (observation is None or isinstance(observation, OwmError) and not isinstance(observation, OwmNotFoundError)):
+                self.cache.degraded += 1
+                observation = fallbacks[id]
+            
+            results[id] = observation if observation is not None else OwmTimeoutError(f"OWM did not answer for {id}")
+        
+        return results
+    
+    async def weather_at_places(self, names: list[str]) -> list["Observation | Exception"]:
+        results: list["Observation | Exception | None"] = [None] * len(names)
+        ids: dict[int, list[int]] = {}
+        unresolved: list[int] = []
+        
+        for index, name in enumerate(names):
+            id = self.cache.get_place_id(normalize_place_name(name))
+            if id is not None and self.cache.get_entry(id) is not None:
+                ids.setdefault(id, []).append(index)
+                continue
+            
+            if self.city_index is not None:
+                try:
+                    id = self.city_index.resolve(name)
+                except CityNotFoundError as e:
+                    results[index] = e
+                    continue
+            
+            if id is None:
+                unresolved.append(index)
+            else:
+                ids.setdefault(id, []).append(index)
+        
+        fetched_by_id, fetched_by_name = await asyncio.gather(
+            self.weather_at_ids(list(ids)),
+            asyncio.gather(*(self.weather_at_place(names[index]) for index in unresolved), return_exceptions=True)
+        )
+        
+        for id, indexes in ids.items():
+            observation = fetched_by_id[id]
+            for index in indexes:
+                results[index] = observation
+                if not isinstance(observation, Exception):
+                    self.cache.put_place(normalize_place_name(names[index]), id)
+        
+        for index, observation in zip(unresolved, fetched_by_name):
+            results[index] = observation
+        
+        return results
+    
+    async def close(self) -> None:
+        await self.backend.close()
+        if self.city_index is not None:
+            self.city_index.close()
+
+class WeatherPrefetcher:
+    def __init__(self, manager: AsyncWeatherManager, calls_per_minute: int, top_k: int = PREFETCH_TOP_K, half_life: float = PREFETCH_HALF_LIFE) -> None:
+        self.manager = manager
+        self.calls_per_minute = calls_per_minute
+        self.top_k = top_k
+        self.decay = 0.5 ** (PREFETCH_INTERVAL / half_life)
+        self.scores: dict[int, float] = {}
+        self.hot: list[int] = []
+        self.credit = 0
+        self.requests = 0
+        self.calls = 0
+        self.refreshed = 0
+        self.skipped = 0
+    
+    def record(self, id: int) -> None:
+        self.scores[id] = self.scores.get(id, 0.0) + 1
+        self.requests += 1
+    
+    def decay_scores(self) -> None:
+        self.scores = {id: score * self.decay for id, score in self.scores.items() if score * self.decay >= PREFETCH_MIN_SCORE}
+        if len(self.scores) > PREFETCH_MAX_TRACKED:
+            self.scores = dict(heapq.nlargest(PREFETCH_MAX_TRACKED, self.scores.items(), key=lambda item: item[1]))
+    
+    def is_due(self, id: int, now: float) -> bool:
+        entry = self.manager.cache.observations.get(id)
+        return entry is None or now - entry[0] >= self.manager.cache.ttl - PREFETCH_LEAD
+    
+    async def run(self) -> None:
+        self.decay_scores()
+        self.hot = [id for id, _ in heapq.nlargest(self.top_k, self.scores.items(), key=lambda item: item[1])]
+        
+        now = time.time()
+        due = [id for id in self.hot if id not in self.manager.refreshing and self.is_due(id, now)]
+        
+        allowance = self.calls_per_minute * PREFETCH_INTERVAL // 60
+        self.credit = min(self.credit + allowance, allowance)
+        
+        group_size = OWM_GROUP_SIZE if self.manager.group_supported else 1
+        ids = due[:max(self.credit, 0) * group_size]
+        self.skipped += len(due) - len(ids)
+        if not ids:
+            return
+        
+        calls = self.manager.prefetch_calls
+        results = await self.manager.refresh_ids(ids, prefetch=True)
+        calls = self.manager.prefetch_calls - calls
+        
+        self.calls += calls
+        self.credit -= calls
+        self.refreshed += sum(1 for observation in results.values() if not isinstance(observation, Exception))
+    
+    def get_stats(self) -> dict[str, Any]:
+        cache = self.manager.cache
+        lookups = cache.hits + cache.stale + cache.misses
+        return {
+            "tracked": len(self.scores),
+            "hot": len(self.hot),
+            "requests": self.requests,
+            "calls": self.calls,
+            "refreshed": self.refreshed,
+            "skipped": self.skipped,
+            "prefetch_hits": cache.prefetch_hits,
+            "hit_rate": cache.hits / lookups if lookups else 0.0,
+            "hit_rate_without_prefetch": (cache.hits - cache.prefetch_hits) / lookups if lookups else 0.0
+        }
+
+@dataclass
+class CityMatch:
+    id: int
+    name: str
+    country: str
+
+class CityNotFoundError(OwmNotFoundError):
+    def __init__(self, message: str, suggestions: list[CityMatch]) -> None:
+        super().__init__(message)
+        self.suggestions = suggestions
+
+def get_name_variants(name: str) -> set[str]:
+    variants = {name}
+    if len(name) <= CITIES_MAX_FUZZY_LENGTH:
+        variants.update(name[:i] + name[i + 1:] for i in range(len(name)))
+    return variants
+
+def get_name_variant_hash(variant: str) -> int:
+    return zlib.crc32(variant.encode())
+
+def is_one_edit_away(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) <= 1:
+            return True
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    
+    if len(a) > len(b):
+        a, b = b, a
+    
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+def is_cyrillic(text: str) -> bool:
+    return any("а" <= char <= "я" or char == "ё" for char in text.casefold())
+
+def read_city_list(source: str) -> list[dict[str, Any]]:
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def build_city_index(source: str, path: str = CITIES_DATABASE) -> None:
+    started = time.perf_counter()
+    cities = read_city_list(source)
+    
+    if os.path.exists(path):
+        os.remove(path)
+    
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA page_size=4096")
+        conn.execute("CREATE TABLE Cities (id INTEGER PRIMARY KEY, name TEXT NOT NULL, country TEXT NOT NULL)")
+        conn.execute("CREATE TABLE CityNames (id INTEGER PRIMARY KEY, name TEXT NOT NULL, display_name TEXT NOT NULL, city_id INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE CityNameVariants (hash INTEGER NOT NULL, name_id INTEGER NOT NULL, PRIMARY KEY (hash, name_id)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE CityIndexInfo (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        
+        name_ids: dict[tuple[str, int], int] = {}
+        
+        def add_name(display_name: str, city_id: int) -> None:
+            name = normalize_place_name(display_name)
+            if not name or (name, city_id) in name_ids:
+                return
+            
+            name_id = len(name_ids) + 1
+            name_ids[(name, city_id)] = name_id
+            conn.execute("INSERT INTO CityNames (id, name, display_name, city_id) VALUES (?, ?, ?, ?)", (name_id, name, display_name, city_id))
+            conn.executemany(
+                "INSERT OR IGNORE INTO CityNameVariants (hash, name_id) VALUES (?, ?)",
+                ((get_name_variant_hash(variant), name_id) for variant in get_name_variants(name))
+            )
+        
+        for city in cities:
+            conn.execute("INSERT OR IGNORE INTO Cities (id, name, country) VALUES (?, ?, ?)", (city["id"], city["name"], city["country"]))
+            add_name(city["name"], city["id"])
+            
+            for lang in city.get("langs", []):
+                if "lang" in lang:
+                    lang = {lang["lang"]: lang.get("name", "")}
+                for code, name in lang.items():
+                    if code in CITIES_LANGUAGES and isinstance(name, str):
+                        add_name(name, city["id"])
+        
+        for alias, (name, country) in CITY_ALIASES.items():
+            for (city_id,) in conn.execute("SELECT id FROM Cities WHERE name = ? AND country = ?", (name, country)).fetchall():
+                add_name(alias, city_id)
+        
+        has_cyrillic = any(is_cyrillic(name) for name, _ in name_ids)
+        conn.execute("INSERT INTO CityIndexInfo (key, value) VALUES ('cyrillic', ?)", (str(int(has_cyrillic)),))
+        conn.execute("CREATE INDEX CityNamesName ON CityNames (name)")
+    
+    with sqlite3.connect(path) as conn:
+        conn.execute("VACUUM")
+    
+    logging.info("Built city index of %d cities and %d names in %.1f s", len(cities), len(name_ids), time.perf_counter() - started)
+
+class CityIndex:
+    def __init__(self, path: str) -> None:
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, factory=InstrumentedConnection)
+        self.conn.execute(f"PRAGMA mmap_size={CITIES_MMAP_SIZE}")
+        self.conn.execute("PRAGMA query_only=ON")
+        
+        row = self.conn.execute("SELECT value FROM CityIndexInfo WHERE key = 'cyrillic'").fetchone()
+        self.has_cyrillic = row is not None and row[0] == "1"
+    
+    @staticmethod
+    def open(path: str = CITIES_DATABASE) -> "CityIndex | None":
+        if not os.path.exists(path):
+            return None
+        
+        return CityIndex(path)
+    
+    def find(self, name: str, country: str | None = None) -> list[CityMatch]:
+        cur = self.conn.execute(
+            "SELECT Cities.id, CityNames.display_name, Cities.country FROM CityNames JOIN Cities ON Cities.id = CityNames.city_id WHERE CityNames.name = ?",
+            (name,)
+        )
+        return [CityMatch(*row) for row in cur if country is None or row[2] == country]
+    
+    def find_prefix(self, prefix: str, limit: int = CITIES_SUGGESTIONS) -> list[CityMatch]:
+        cur = self.conn.execute(
+            "SELECT Cities.id, CityNames.display_name, Cities.country FROM CityNames JOIN Cities ON Cities.id = CityNames.city_id WHERE CityNames.name >= ? AND CityNames.name < ? ORDER BY CityNames.name LIMIT ?",
+            (prefix, prefix + "\uffff", limit)
+        )
+        return [CityMatch(*row) for row in cur]
+    
+    def find_similar(self, name: str, limit: int = CITIES_SUGGESTIONS) -> list[CityMatch]:
+        hashes = [get_name_variant_hash(variant) for variant in get_name_variants(name)]
+        cur = self.conn.execute(
+            f"SELECT DISTINCT CityNames.name, Cities.id, CityNames.display_name, Cities.country FROM CityNameVariants "
+            f"JOIN CityNames ON CityNames.id = CityNameVariants.name_id JOIN Cities ON Cities.id = CityNames.city_id "
+            f"WHERE CityNameVariants.hash IN ({', '.join('?' * len(hashes))})",
+            hashes
+        )
+        
+        matches: list[CityMatch] = []
+        for candidate, *row in cur:
+            if candidate != name and is_one_edit_away(candidate, name):
+                matches.append(CityMatch(*row))
+                if len(matches) >= limit:
+                    break
+        return matches
+    
+    def resolve(self, query: str) -> int | None:
+        name, _, country = query.rpartition(",")
+        country = country.strip().upper()
+        if not name or len(country) != 2:
+            name, country = query, None
+        
+        name = normalize_place_name(name)
+        if is_cyrillic(name) and not self.has_cyrillic:
+            return None
+        
+        matches = self.find(name, country)
+        if len({match.id for match in matches}) == 1:
+            return matches[0].id
+        if matches:
+            return None
+        
+        suggestions = self.find_similar(name) or self.find_prefix(name)
+        raise CityNotFoundError(f"City {query} is not in the local index", suggestions)
+    
+    def close(self) -> None:
+        self.conn.close()
+
+mgr: AsyncWeatherManager | None = None
+bot: Bot | None = None
+
+dp = Dispatcher(storage=fsm_storage)
+reminder_router = Router()
+
+def get_word_case(count: int, words: list[str]) -> str:
+    ONE = 0
+    FEW = 1
+    OTHER = 2
+    
+    if (count % 10 == 1) and not (count % 100 == 11):
+        return words[ONE]
+    
+    if (count % 100) > 11 and (count % 100) <= 15:
+        return words[OTHER]
+    
+    if (count % 10 >= 2) and (count % 10 <= 4):
+        return words[FEW]
+    
+    return words[OTHER]
+
+def get_current_timestamp() -> float:
+    now = datetime.now()
+    return calendar.timegm(now.timetuple()) + now.microsecond / 1_000_000
+
+def create_reminders_db() -> None:
+    os.makedirs(DATABASES_DIRECTORY, exist_ok=True)
+    
+    conn = sqlite3.connect(REMINDERS_DATABASE, isolation_level=None)
+    try:
+        (auto_vacuum,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+        if auto_vacuum != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+    
+    with reminders_pool.connection() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS Reminders (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, expires_in INTEGER NOT NULL, content TEXT NOT NULL)")
+        
+        columns = {name for _, name, *_ in conn.execute("PRAGMA table_info(Reminders)")}
+        for column in ("repeat_unit INTEGER", "repeat_every INTEGER", "starts_at INTEGER", "occurrence INTEGER NOT NULL DEFAULT 0"):
+            if column.split()[0] not in columns:
+                conn.execute(f"ALTER TABLE Reminders ADD COLUMN {column}")
+        
+        conn.execute("CREATE INDEX IF NOT EXISTS RemindersChatExpiration ON Reminders (chat_id, expires_in)")
+        conn.execute("CREATE INDEX IF NOT EXISTS RemindersExpiration ON Reminders (expires_in)")
+        conn.execute("CREATE INDEX IF NOT EXISTS RemindersRules ON Reminders (expires_in) WHERE repeat_unit IS NOT NULL")
+        conn.execute("CREATE TABLE IF NOT EXISTS FsmStates (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS FsmStatesExpiration ON FsmStates (expires_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS MigratedDatabases (chat_id INTEGER PRIMARY KEY)")
+        conn.execute("CREATE TABLE IF NOT EXISTS Leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, watermark INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS WeatherObservations (id INTEGER PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS WeatherPlaces (name TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS Subscriptions (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, city_id INTEGER NOT NULL, city_name TEXT NOT NULL, minute INTEGER NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS SubscriptionsDelivery ON Subscriptions (minute, city_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS SubscriptionsChat ON Subscriptions (chat_id)")
+
+def migrate_chat_databases() -> None:
+    conn = sqlite3.connect(REMINDERS_DATABASE, isolation_level=None)
+    
+    try:
+        for name in os.listdir(DATABASES_DIRECTORY):
+            chat_id_text, extension = os.path.splitext(name)
+            if extension != ".db" or not chat_id_text.lstrip("-").isdigit():
+                continue
+            
+            chat_id = int(chat_id_text)
+            path = os.path.join(DATABASES_DIRECTORY, name)
+            
+            migrated = conn.execute("SELECT 1 FROM MigratedDatabases WHERE chat_id = ?", (chat_id,)).fetchone()
+            if migrated is None:
+                conn.execute("ATTACH DATABASE ? AS chat", (path,))
+                try:
+                    conn.execute("BEGIN")
+                    (expected,) = conn.execute("SELECT COUNT(*) FROM chat.Reminders").fetchone()
+                    copied = conn.execute("INSERT INTO Reminders (chat_id, expires_in, content) SELECT ?, expires_in, content FROM chat.Reminders ORDER BY id", (chat_id,)).rowcount
+                    if copied != expected:
+                        logging.error("Copied %d of %d reminders from the database of chat %d, keeping %s", copied, expected, chat_id, path)
+                        continue
+                    
+                    conn.execute("INSERT INTO MigratedDatabases (chat_id) VALUES (?)", (chat_id,))
+                    conn.execute("COMMIT")
+                finally:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    conn.execute("DETACH DATABASE chat")
+            
+            os.replace(path, f"{path}.migrated")
+            logging.info("Migrated reminders database of chat %d, the old file is kept as %s.migrated", chat_id, path)
+    finally:
+        conn.close()
+
+def get_pending_reminder_ids(chat_id: int) -> list[int]:
+    now = datetime.now()
+    timestamp = calendar.timegm(now.timetuple())
+    
+    with reminders_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM Reminders WHERE chat_id = ? AND expires_in >= ?", (chat_id, timestamp))
+        return [id for (id,) in cur.fetchall()]
+
+async def reset_reminders(chat_id: int) -> None:
+    pending_ids = await asyncio.to_thread(get_pending_reminder_ids, chat_id)
+    
+    await reminders_writer.execute("DELETE FROM Reminders WHERE chat_id = ?", [(chat_id,)])
+    
+    for id in pending_ids:
+        reminder_scheduler.discard(id)
+
+def get_repeat_delta(unit: TimeUnit, count: int) -> "relativedelta":
+    from dateutil.relativedelta import relativedelta
+    
+    match unit:
+        case TimeUnit.YEAR: return relativedelta(years=count)
+        case TimeUnit.MONTH: return relativedelta(months=count)
+        case TimeUnit.DAY: return relativedelta(days=count)
+        case TimeUnit.HOUR: return relativedelta(hours=count)
+        case TimeUnit.MINUTE: return relativedelta(minutes=count)
+        case TimeUnit.SECOND: return relativedelta(seconds=count)
+
+def get_next_occurrence(starts_at: int, unit: TimeUnit, every: int, occurrence: int, after: float) -> tuple[int, int] | None:
+    start = datetime.fromtimestamp(starts_at, UTC).replace(tzinfo=None)
+    
+    skipped = int((after - starts_at) // (every * TIME_UNIT_MAX_SECONDS[unit])) - 1
+    occurrence = max(occurrence, skipped)
+    
+    try:
+        while True:
+            occurrence += 1
+            timestamp = calendar.timegm((start + get_repeat_delta(unit, every * occurrence)).timetuple())
+            if timestamp > after:
+                return timestamp, occurrence
+    except (OverflowError, ValueError):
+        return None
+
+def parse_repeat_rule(text: str) -> tuple[TimeUnit, int] | None:
+    text = " ".join(text.casefold().split())
+    
+    preset = REPEAT_PRESETS.get(text)
+    if preset is not None:
+        return preset
+    
+    words = text.split(" ")
+    if len(words) != 3 or words[0] not in ("каждые", "каждый", "каждую", "каждое") or not words[1].isdigit():
+        return None
+    
+    count = int(words[1])
+    if not 1 <= count <= REPEAT_MAX_EVERY:
+        return None
+    
+    for stem, unit, multiplier in REPEAT_UNIT_STEMS:
+        if words[2].startswith(stem):
+            return unit, count * multiplier
+    
+    return None
+
+def get_repeat_text(unit: TimeUnit, every: int) -> str:
+    if unit == TimeUnit.DAY and every % 7 == 0:
+        weeks = every // 7
+        return "каждую неделю" if weeks == 1 else f"каждые {weeks} {get_word_case(weeks, ('неделю', 'недели', 'недель'))}"
+    
+    if every == 1:
+        return EVERY_TIME_UNIT[unit]
+    
+    return f"каждые {every} {get_word_case(every, TIME_UNIT_CASES[unit])}"
+
+async def add_reminder(chat_id: int, text: str, date: int, repeat: tuple[TimeUnit, int] | None = None) -> Reminder:
+    if repeat is None:
+        [id] = await reminders_writer.execute("INSERT INTO Reminders (chat_id, expires_in, content) VALUES (?, ?, ?)", [(chat_id, date, text)])
+    else:
+        unit, every = repeat
+        starts_at = date
+        occurrence = 0
+        
+        now = get_current_timestamp()
+        if date <= now:
+            next_occurrence = get_next_occurrence(starts_at, unit, every, occurrence, now)
+            if next_occurrence is not None:
+                date, occurrence = next_occurrence
+        
+        [id] = await reminders_writer.execute(
+            "INSERT INTO Reminders (chat_id, expires_in, content, repeat_unit, repeat_every, starts_at, occurrence) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(chat_id, date, text, unit.value, every, starts_at, occurrence)]
+        )
+    
+    reminder_scheduler.push_if_loaded(chat_id, id, date)
+    return Reminder(id, date, text, repeat=repeat)
+
+async def delete_repeating_reminder(chat_id: int, id: int) -> bool:
+    deleted = await reminders_writer.execute("DELETE FROM Reminders WHERE id = ? AND chat_id = ? AND repeat_unit IS NOT NULL", [(id, chat_id)])
+    
+    if deleted:
+        reminder_scheduler.discard(id)
+    return deleted > 0
+
+def format_reminder_date(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, UTC).strftime("%H:%M %d/%m/%Y")
+
+def iter_chat_reminders(chat_id: int) -> Iterator[tuple[int, int, str, int | None, int | None]]:
+    timestamp = calendar.timegm(datetime.now().timetuple())
+    cursor = (-sys.maxsize - 1, 0)
+    
+    with reminders_pool.connection() as conn:
+        while True:
+            cur = conn.execute(
+                "SELECT id, expires_in, content, repeat_unit, repeat_every FROM Reminders WHERE chat_id = ? AND (expires_in, id) > (?, ?) AND (expires_in > ? OR repeat_unit IS NOT NULL) ORDER BY expires_in, id LIMIT ?",
+                (chat_id, *cursor, timestamp, REMINDERS_EXPORT_PAGE_SIZE)
+            )
+            rows = cur.fetchall()
+            yield from rows
+            
+            if len(rows) < REMINDERS_EXPORT_PAGE_SIZE:
+                break
+            
+            cursor = (rows[-1][1], rows[-1][0])
+
+def write_reminders_csv(file: TextIO, reminders: Iterable[tuple[int, int, str, int | None, int | None]]) -> int:
+    writer = csv.writer(file)
+    writer.writerow(("date", "text", "repeat"))
+    
+    count = 0
+    for _, date, text, repeat_unit, repeat_every in reminders:
+        repeat = "" if repeat_unit is None else get_repeat_text(TimeUnit(repeat_unit), repeat_every)
+        writer.writerow((format_reminder_date(date), text, repeat))
+        count += 1
+    
+    return count
+
+def escape_ical_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def unescape_ical_text(text: str) -> str:
+    return ICAL_ESCAPE_PATTERN.sub(lambda match: ICAL_ESCAPES.get(match.group(1), match.group(1)), text)
+
+def fold_ical_line(line: str) -> str:
+    parts = []
+    part = ""
+    size = 0
+    for char in line:
+        length = len(char.encode())
+        if size + length > ICAL_LINE_LIMIT:
+            parts.append(part)
+            part = ""
+            size = 1
+        
+        part += char
+        size += length
+    parts.append(part)
+    
+    return "\r\n ".join(parts) + "\r\n"
+
+def get_ical_rrule(unit: TimeUnit, every: int) -> str:
+    if unit == TimeUnit.DAY and every % 7 == 0:
+        return f"FREQ=WEEKLY;INTERVAL={every // 7}"
+    
+    return f"FREQ={ICAL_UNIT_FREQUENCIES[unit]};INTERVAL={every}"
+
+def write_reminders_ical(file: TextIO, reminders: Iterable[tuple[int, int, str, int | None, int | None]]) -> int:
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+    file.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Practice//Reminders//RU\r\n")
+    
+    count = 0
+    for id, date, text, repeat_unit, repeat_every in reminders:
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:reminder-{id}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{datetime.fromtimestamp(date, UTC).strftime('%Y%m%dT%H%M%S')}",
+            f"SUMMARY:{escape_ical_text(text)}"
+        ]
+        if repeat_unit is not None:
+            lines.append(f"RRULE:{get_ical_rrule(TimeUnit(repeat_unit), repeat_every)}")
+        lines.append("END:VEVENT")
+        
+        file.write("".join(fold_ical_line(line) for line in lines))
+        count += 1
+    
+    file.write("END:VCALENDAR\r\n")
+    return count
+
+def export_reminders(chat_id: int, format: ReminderFormat) -> str | None:
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8-sig" if format == ReminderFormat.CSV else "utf-8", newline="", suffix=f".{format.value}", delete=False) as file:
+        if format == ReminderFormat.CSV:
+            count = write_reminders_csv(file, iter_chat_reminders(chat_id))
+        else:
+            count = write_reminders_ical(file, iter_chat_reminders(chat_id))
+    
+    if count == 0:
+        os.remove(file.name)
+        return None
+    
+    return file.name
+
+class ReminderImportError(ValueError):
+    pass
+
+def parse_imported_reminder(date: str, text: str, repeat: tuple[TimeUnit, int] | None, now: datetime) -> tuple[int, str, tuple[TimeUnit, int] | None]:
+    try:
+        timestamp = calendar.timegm(parse_reminder_date(" ".join(date.split()), now).timetuple())
+    except ReminderDateError as e:
+        raise ReminderImportError(str(e).split("\n")[0])
+    except ValueError:
+        raise ReminderImportError("Вы указали дату неправильно.")
+    
+    text = text.strip()
+    if not text:
+        raise ReminderImportError("Не указан текст напоминания.")
+    
+    if len(text) > REMINDERS_IMPORT_TEXT_LIMIT:
+        raise ReminderImportError(f"Текст напоминания длиннее {REMINDERS_IMPORT_TEXT_LIMIT} символов.")
+    
+    return timestamp, text, repeat
+
+def read_csv_reminders(file: TextIO, now: datetime) -> Iterator[tuple[int, tuple[int, str, tuple[TimeUnit, int] | None] | str]]:
+    reader = csv.reader(file)
+    for row in reader:
+        line = reader.line_num
+        if not any(cell.strip() for cell in row):
+            continue
+        
+        if line == 1 and row[0].strip().casefold() in ("date", "дата"):
+            continue
+        
+        if len(row) < 2:
+            yield line, "Ожидаются дата и текст напоминания."
+            continue
+        
+        repeat = None
+        if len(row) > 2 and row[2].strip():
+            repeat = parse_repeat_rule(row[2])
+            if repeat is None:
+                yield line, "Не удалось распознать период повторения."
+                continue
+        
+        try:
+            yield line, parse_imported_reminder(row[0], row[1], repeat, now)
+        except ReminderImportError as e:
+            yield line, str(e)
+
+def read_ical_lines(file: TextIO) -> Iterator[tuple[int, str]]:
+    logical = None
+    start = 0
+    
+    for number, line in enumerate(file, start=1):
+        line = line.rstrip("\r\n")
+        if logical is not None and line[:1] in (" ", "\t"):
+            logical += line[1:]
+            continue
+        
+        if logical is not None:
+            yield start, logical
+        logical, start = line, number
+    
+    if logical is not None:
+        yield start, logical
+
+def parse_ical_property(line: str) -> tuple[str, dict[str, str], str]:
+    head, _, value = line.partition(":")
+    name, *params = head.split(";")
+    return name.upper(), {key.upper(): param.strip('"') for key, _, param in (param.partition("=") for param in params)}, value
+
+def parse_ical_date(params: dict[str, str], value: str) -> str:
+    value = value.strip()
+    
+    try:
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            date = datetime.strptime(value, "%Y%m%d").replace(hour=ICAL_ALL_DAY_HOUR)
+        else:
+            date = datetime.strptime(value.removesuffix("Z"), "%Y%m%dT%H%M%S")
+    except ValueError:
+        raise ReminderImportError("Не удалось распознать дату начала события.")
+    
+    if value.endswith("Z"):
+        date = date.replace(tzinfo=UTC).astimezone().replace(tzinfo=None)
+    elif "TZID" in params:
+        try:
+            date = date.replace(tzinfo=ZoneInfo(params["TZID"])).astimezone().replace(tzinfo=None)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    
+    return date.strftime("%H:%M %d/%m/%Y")
+
+def parse_ical_rrule(value: str) -> tuple[TimeUnit, int] | None:
+    parts = {key: part for key, _, part in (part.partition("=") for part in value.upper().split(";") if part)}
+    frequency = ICAL_FREQUENCIES.get(parts.pop("FREQ", ""))
+    interval = parts.pop("INTERVAL", "1")
+    parts.pop("WKST", None)
+    
+    if frequency is None or parts or not interval.isdigit() or not 1 <= int(interval) <= REPEAT_MAX_EVERY:
+        return None
+    
+    unit, multiplier = frequency
+    return unit, int(interval) * multiplier
+
+def parse_ical_event(event: dict[str, tuple[dict[str, str], str]], now: datetime) -> tuple[int, str, tuple[TimeUnit, int] | None]:
+    if "DTSTART" not in event:
+        raise ReminderImportError("У события нет даты начала.")
+    
+    repeat = None
+    if "RRULE" in event:
+        repeat = parse_ical_rrule(event["RRULE"][1])
+        if repeat is None:
+            raise ReminderImportError("Правило повторения не поддерживается.")
+    
+    _, summary = event.get("SUMMARY", ({}, ""))
+    return parse_imported_reminder(parse_ical_date(*event["DTSTART"]), unescape_ical_text(summary), repeat, now)
+
+def read_ical_reminders(file: TextIO, now: datetime) -> Iterator[tuple[int, tuple[int, str, tuple[TimeUnit, int] | None] | str]]:
+    event: dict[str, tuple[dict[str, str], str]] | None = None
+    event_line = 0
+    
+    for line, text in read_ical_lines(file):
+        name, params, value = parse_ical_property(text)
+        
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            event = {}
+            event_line = line
+        elif event is None:
+            continue
+        elif name == "END" and value.upper() == "VEVENT":
+            try:
+                yield event_line, parse_ical_event(event, now)
+            except ReminderImportError as e:
+                yield event_line, str(e)
+            event = None
+        elif name in ("DTSTART", "SUMMARY", "RRULE") and name not in event:
+            event[name] = (params, value)
+
+def get_import_format(name: str | None, head: bytes) -> ReminderFormat:
+    extension = os.path.splitext(name or "")[1].casefold()
+    if extension in (".ics", ".ical", ".ifb"):
+        return ReminderFormat.ICAL
+    if extension != ".csv" and b"BEGIN:VCALENDAR" in head.upper():
+        return ReminderFormat.ICAL
+    return ReminderFormat.CSV
+
+async def import_reminders(chat_id: int, file: BinaryIO, format: ReminderFormat) -> tuple[int, list[tuple[int, str]], bool]:
+    now = datetime.now()
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", errors="replace", newline="" if format == ReminderFormat.CSV else None)
+    rows = read_csv_reminders(text, now) if format == ReminderFormat.CSV else read_ical_reminders(text, now)
+    
+    imported: list[tuple[int, int, int]] = []
+    errors: list[tuple[int, str]] = []
+    processed = 0
+    
+    while processed < REMINDERS_IMPORT_MAX_ROWS:
+        batch = await asyncio.to_thread(list, itertools.islice(rows, min(REMINDERS_IMPORT_BATCH_SIZE, REMINDERS_IMPORT_MAX_ROWS - processed)))
+        if not batch:
+            break
+        processed += len(batch)
+        
+        values = []
+        for line, result in batch:
+            if isinstance(result, str):
+                errors.append((line, result))
+                continue
+            
+            date, content, repeat = result
+            if repeat is None:
+                values.append((chat_id, date, content, None, None, None, 0))
+            else:
+                values.append((chat_id, date, content, repeat[0].value, repeat[1], date, 0))
+        
+        if values:
+            ids = await reminders_writer.execute(
+                "INSERT INTO Reminders (chat_id, expires_in, content, repeat_unit, repeat_every, starts_at, occurrence) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+            imported.extend((chat_id, id, date) for id, (_, date, *_) in zip(ids, values))
+    
+    truncated = processed >= REMINDERS_IMPORT_MAX_ROWS and await asyncio.to_thread(next, rows, None) is not None
+    
+    reminder_scheduler.push_many_if_loaded(imported)
+    return len(imported), errors, truncated
+
+def load_reminders_window(until: int, since: int | None = None) -> int:
+    if since is None:
+        now = datetime.now()
+        since = calendar.timegm(now.timetuple())
+    
+    start = reminder_scheduler.advance_window(since, until)
+    if until <= start:
+        return 0
+    
+    loaded = 0
+    cursor = (start, sys.maxsize)
+    with reminders_pool.connection() as conn:
+        while True:
+            cur = conn.execute(
+                "SELECT id, chat_id, expires_in FROM Reminders WHERE (expires_in, id) > (?, ?) AND expires_in <= ? ORDER BY expires_in, id LIMIT ?",
+                (*cursor, until, REMINDERS_LOAD_PAGE_SIZE)
+            )
+            rows = cur.fetchall()
+            
+            for id, chat_id, date in rows:
+                reminder_scheduler.push(chat_id, id, date)
+            loaded += len(rows)
+            
+            if len(rows) < REMINDERS_LOAD_PAGE_SIZE:
+                break
+            
+            last_id, _, last_date = rows[-1]
+            cursor = (last_date, last_id)
+    
+    return loaded
+
+def vacuum_reminders_db() -> int:
+    with reminders_pool.connection() as conn:
+        (free_pages,) = conn.execute("PRAGMA freelist_count").fetchone()
+        conn.executescript(f"PRAGMA incremental_vacuum({REMINDERS_VACUUM_PAGES});")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    
+    return min(free_pages, REMINDERS_VACUUM_PAGES)
+
+async def compact_reminders() -> None:
+    started = time.perf_counter()
+    
+    now = datetime.now()
+    timestamp = calendar.timegm(now.timetuple()) - REMINDERS_RETENTION
+    
+    deleted = 0
+    while True:
+        count = await reminders_writer.execute(
+            "DELETE FROM Reminders WHERE id IN (SELECT id FROM Reminders WHERE expires_in < ? AND repeat_unit IS NULL LIMIT ?)",
+            [(timestamp, REMINDERS_COMPACTION_BATCH_SIZE)]
+        )
+        deleted += count
+        if count < REMINDERS_COMPACTION_BATCH_SIZE:
+            break
+    
+    freed_pages = await asyncio.to_thread(vacuum_reminders_db)
+    stale_count = reminder_scheduler.compact()
+    reminder_delivery.compact()
+    
+    logging.info(
+        "Compacted reminders in %.3f s: %d expired rows deleted, %d pages freed, %d stale scheduler entries dropped",
+        time.perf_counter() - started, deleted, freed_pages, stale_count
+    )
+
+async def purge_fsm_states() -> None:
+    purged = await fsm_storage.purge()
+    logging.info("Purged %d expired FSM states", purged)
+
+async def load_upcoming_reminders(since: int | None = None) -> None:
+    started = time.perf_counter()
+    until = int(get_current_timestamp()) + REMINDERS_LOAD_HORIZON
+    
+    loaded = await asyncio.to_thread(load_reminders_window, until, since)
+    
+    logging.info("Loaded %d pending reminders in %.3f s, %d scheduled", loaded, time.perf_counter() - started, len(reminder_scheduler))
+
+def reset_reminders_window(since: int | None = None) -> None:
+    reminder_scheduler.clear()
+    
+    if since is None:
+        now = datetime.now()
+        since = calendar.timegm(now.timetuple())
+    
+    with reminders_pool.connection() as conn:
+        (last_id,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM Reminders").fetchone()
+        overdue_rules = conn.execute("SELECT id, chat_id, expires_in FROM Reminders WHERE repeat_unit IS NOT NULL AND expires_in <= ?", (since,)).fetchall()
+    
+    reminder_scheduler.last_seen_id = last_id
+    for id, chat_id, date in overdue_rules:
+        reminder_scheduler.push(chat_id, id, date)
+
+def load_new_reminders() -> int:
+    loaded = 0
+    
+    with reminders_pool.connection() as conn:
+        while True:
+            cur = conn.execute(
+                "SELECT id, chat_id, expires_in FROM Reminders WHERE id > ? ORDER BY id LIMIT ?",
+                (reminder_scheduler.last_seen_id, REMINDERS_LOAD_PAGE_SIZE)
+            )
+            rows = cur.fetchall()
+            
+            for id, chat_id, date in rows:
+                reminder_scheduler.push_if_loaded(chat_id, id, date)
+            loaded += len(rows)
+            
+            if rows:
+                reminder_scheduler.last_seen_id = rows[-1][0]
+            if len(rows) < REMINDERS_LOAD_PAGE_SIZE:
+                break
+    
+    return loaded
+
+async def poll_new_reminders() -> None:
+    await asyncio.to_thread(load_new_reminders)
+
+def get_reminders_page(chat_id: int, direction: PageDirection = PageDirection.NEXT, cursor: tuple[int, int] = (-sys.maxsize - 1, 0), offset: int = 0) -> ReminderPage:
+    now = datetime.now()
+    timestamp = calendar.timegm(now.timetuple())
+    
+    with reminders_pool.connection() as conn:
+        if direction == PageDirection.NEXT:
+            cur = conn.execute(
+                "SELECT id, expires_in, content, repeat_unit, repeat_every FROM Reminders WHERE chat_id = ? AND (expires_in, id) > (?, ?) ORDER BY expires_in, id LIMIT ?",
+                (chat_id, *cursor, REMINDERS_PAGE_SIZE + 1)
+            )
+            rows = cur.fetchall()
+        else:
+            cur = conn.execute(
+                "SELECT id, expires_in, content, repeat_unit, repeat_every FROM Reminders WHERE chat_id = ? AND (expires_in, id) < (?, ?) ORDER BY expires_in DESC, id DESC LIMIT ?",
+                (chat_id, *cursor, REMINDERS_PAGE_SIZE + 1)
+            )
+            rows = cur.fetchall()
+        
+        cur = conn.execute("SELECT 1 FROM Reminders WHERE chat_id = ? AND expires_in <= ? AND repeat_unit IS NULL LIMIT 1", (chat_id, timestamp))
+        has_completed = cur.fetchone() is not None
+    
+    has_more = len(rows) > REMINDERS_PAGE_SIZE
+    rows = rows[:REMINDERS_PAGE_SIZE]
+    
+    if direction == PageDirection.NEXT:
+        has_previous = offset > 0
+        has_next = has_more
+    else:
+        rows.reverse()
+        offset = max(0, offset - len(rows))
+        has_previous = has_more
+        has_next = True
+    
+    reminders = [
+        Reminder(id, date, text, timestamp < date or repeat_unit is not None, None if repeat_unit is None else (TimeUnit(repeat_unit), repeat_every))
+        for id, date, text, repeat_unit, repeat_every in rows
+    ]
+    return ReminderPage(reminders, offset, has_previous, has_next, has_completed)
+
+@dp.message(CommandStart())
+async def command_start_handler(message: Message) -> None:
+    await reset_reminders(message.chat.id)
+    await message.answer(START_MESSAGE)
+
+def parse_place_names(text: str) -> list[str]:
+    names: list[str] = []
+    seen: set[str] = set()
+    
+    for part in re.split(r"[,;\n]", text):
+        part = part.strip()
+        if len(part) == 2 and part.upper() in COUNTRY_CODE_TO_COUNTRY_NAME and names:
+            names[-1] = f"{names[-1]}, {part.upper()}"
+            continue
+        
+        if part:
+            names.append(part)
+    
+    unique = []
+    for name in names:
+        key = normalize_place_name(name)
+        if key not in seen:
+            seen.add(key)
+            unique.append(name)
+    
+    return unique
+
+def get_weather_text(observation: "Observation") -> str:
+    w: Weather = observation.weather
+    l: Location = observation.location
+    
+    detailed_status: str = w.detailed_status
+    country_name = COUNTRY_CODE_TO_COUNTRY_NAME[l.country]
+    temperature = w.temperature(unit="celsius")
+    temp = int(round(temperature["temp"]))
+    temp_max = int(round(temperature["temp_max"]))
+    temp_min = int(round(temperature["temp_min"]))
+    feels_like = int(round(temperature["feels_like"]))
+    humidity = w.humidity
+    
+    wind = w.wind()
+    wind_speed = wind["speed"]
+    
+    flag = COUNTRY_CODE_TO_FLAG[l.country]
+    
+    text = f"Место: <b>{l.name}, {country_name} {flag}</b>\nПогода: <b>{detailed_status.capitalize()}</b>\nТемпература: <b>{temp} °C</b>\nМакс. температура: <b>{temp_max} °C</b>\nМин. температура: <b>{temp_min} °C</b>\nОщущается как: <b>{feels_like} °C</b>\nВлажность: <b>{humidity}%</b>\nВетер: <b>{wind_speed} м/c</b>"
+    
+    age = time.time() - observation.reception_time()
+    if age >= WEATHER_CACHE_TTL:
+        text += f"\n<i>Обновлено {get_age_text(age)} назад</i>"
+    
+    return text
+
+def get_age_text(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} {get_word_case(minutes, TIME_UNIT_CASES[TimeUnit.MINUTE])}"
+    
+    hours = minutes // 60
+    return f"{hours} {get_word_case(hours, TIME_UNIT_CASES[TimeUnit.HOUR])}"
+
+def get_city_suggestions_text(suggestions: list[CityMatch]) -> str:
+    return ", ".join(f"{city.name} ({COUNTRY_CODE_TO_COUNTRY_NAME.get(city.country, city.country)})" for city in suggestions)
+
+def get_place_weather_text(name: str, result: "Observation | Exception") -> str:
+    if isinstance(result, CityNotFoundError) and result.suggestions:
+        return f"<b>{html.escape(name)}</b>: город не найден :(\nВозможно, вы имели в виду: {get_city_suggestions_text(result.suggestions)}"
+    if isinstance(result, OwmNotFoundError):
+        return f"<b>{html.escape(name)}</b>: город не найден :("
+    if isinstance(result, Exception):
+        logging.warning("Failed to get weather for %s - %s: %s", name, type(result).__name__, result)
+        return f"<b>{html.escape(name)}</b>: не удалось получить погоду"
+    
+    return get_weather_text(result)
+
+def join_message_parts(parts: list[str], separator: str = "\n\n") -> list[str]:
+    messages = []
+    current = ""
+    for part in parts:
+        if current and len(current) + len(separator) + len(part) > TELEGRAM_MESSAGE_LIMIT:
+            messages.append(current)
+            current = part
+        else:
+            current = f"{current}{separator}{part}" if current else part
+    
+    if current:
+        messages.append(current)
+    return messages
+
+async def command_weather_places_handler(message: Message, names: list[str]) -> None:
+    if len(names) > WEATHER_MAX_PLACES:
+        await message.answer(f"Можно указать не больше <b>{WEATHER_MAX_PLACES}</b> городов за раз.")
+        return
+    
+    results = await mgr.weather_at_places(names)
+    mgr.record_requests(results)
+    for text in join_message_parts([get_place_weather_text(name, result) for name, result in zip(names, results)]):
+        await message.answer(text)
+
+@dp.message(Command(WEATHER_COMMAND))
+async def command_weather_handler(message: Message, command: CommandObject) -> None:
+    if command.args is None or command.args.isspace():
+        await message.answer("Вы не указали город.\nПример использования: /weather Санкт-Петербург\nНесколько городов: /weather Москва, Казань, Сочи")
+        return
+    
+    names = parse_place_names(command.args)
+    if len(names) > 1:
+        await command_weather_places_handler(message, names)
+        return
+    
+    try:
+        observation = await mgr.weather_at_place(command.args)
+    except CityNotFoundError as e:
+        if not e.suggestions:
+            await message.answer("Город не найден :(")
+            return
+        
+        await message.answer(f"Город не найден :(\nВозможно, вы имели в виду: {get_city_suggestions_text(e.suggestions)}")
+        return
+    except OwmNotFoundError:
+        await message.answer("Город не найден :(")
+        return
+    except OwmError as e:
+        logging.warning("Failed to get weather for %s - %s: %s", command.args, type(e).__name__, e)
+        await message.answer("Сервис погоды сейчас недоступен, попробуйте позже.")
+        return
+    
+    mgr.record_requests([observation])
+    await message.answer(get_weather_text(observation))
+
+@dataclass
+class Subscription:
+    id: int
+    city_id: int
+    city_name: str
+    minute: int
+
+def get_chat_subscriptions(chat_id: int) -> list[Subscription]:
+    with reminders_pool.connection() as conn:
+        rows = conn.execute("SELECT id, city_id, city_name, minute FROM Subscriptions WHERE chat_id = ? ORDER BY minute, id", (chat_id,)).fetchall()
+    return [Subscription(*row) for row in rows]
+
+def get_due_subscriptions(minute: int) -> dict[int, list[int]]:
+    groups: dict[int, list[int]] = {}
+    with reminders_pool.connection() as conn:
+        for city_id, chat_id in conn.execute("SELECT city_id, chat_id FROM Subscriptions WHERE minute = ? ORDER BY city_id", (minute,)):
+            groups.setdefault(city_id, []).append(chat_id)
+    return groups
+
+async def add_subscription(chat_id: int, city_id: int, city_name: str, minute: int) -> int:
+    (id,) = await reminders_writer.execute("INSERT INTO Subscriptions (chat_id, city_id, city_name, minute) VALUES (?, ?, ?, ?)", [(chat_id, city_id, city_name, minute)])
+    return id
+
+async def delete_subscription(chat_id: int, id: int) -> bool:
+    return await reminders_writer.execute("DELETE FROM Subscriptions WHERE id = ? AND chat_id = ?", [(id, chat_id)]) > 0
+
+def format_minute(minute: int) -> str:
+    return f"{minute // 60:02}:{minute % 60:02}"
+
+class SubscriptionSender:
+    def __init__(self) -> None:
+        self.sent_until: int | None = None
+        self.minutes = 0
+        self.cities = 0
+        self.fetched = 0
+        self.deliveries = 0
+        self.failed = 0
+    
+    async def get_observations(self, ids: list[int]) -> dict[int, "Observation | Exception"]:
+        observations: dict[int, "Observation | Exception"] = {}
+        missing = []
+        for id in ids:
+            observation = mgr.cache.get(id)
+            if observation is None:
+                missing.append(id)
+            else:
+                observations[id] = observation
+        
+        if missing:
+            self.fetched += len(missing)
+            for id, observation in (await mgr.refresh_ids(missing)).items():
+                entry = mgr.cache.get_entry(id)
+                if isinstance(observation, Exception) and entry is not None:
+                    mgr.cache.degraded += 1
+                    observation = entry[1]
+                observations[id] = observation
+        
+        return observations
+    
+    async def send_minute(self, minute: int) -> None:
+        groups = await asyncio.to_thread(get_due_subscriptions, minute % MINUTES_PER_DAY)
+        self.minutes += 1
+        if not groups:
+            return
+        
+        observations = await self.get_observations(list(groups))
+        self.cities += len(groups)
+        
+        for city_id, chat_ids in groups.items():
+            observation = observations[city_id]
+            if isinstance(observation, Exception):
+                logging.warning("Failed to get weather for subscribed city %d - %s: %s", city_id, type(observation).__name__, observation)
+                self.failed += len(chat_ids)
+                continue
+            
+            text = f"Погода на сегодня:\n\n{get_weather_text(observation)}"
+            for chat_id in chat_ids:
+                reminder_delivery.submit(chat_id, text, minute * 60)
+            self.deliveries += len(chat_ids)
+    
+    async def run(self) -> None:
+        minute = int(get_current_timestamp() // 60)
+        if self.sent_until is None:
+            self.sent_until = minute - 1
+        
+        for due in range(max(self.sent_until + 1, minute - SUBSCRIPTIONS_CATCHUP_MINUTES), minute + 1):
+            await self.send_minute(due)
+            self.sent_until = due
+    
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "minutes": self.minutes,
+            "cities": self.cities,
+            "fetched": self.fetched,
+            "deliveries": self.deliveries,
+            "failed": self.failed
+        }
+
+subscription_sender = SubscriptionSender()
+
+def get_current_reminders_text(reminders: list[Reminder], start: int = 1) -> str | None:
+    if len(reminders) == 0:
+        return None
+    
+    lines = ["Список напоминаний:\n"]
+    for i, reminder in enumerate(reminders, start=start):
+        date = datetime.fromtimestamp(reminder.date, UTC).strftime("%H:%M, %d/%m/%Y")
+        status = '\u231B' if reminder.active else '\u2705'
+        text = reminder.text
+        if len(text) > REMINDERS_PAGE_TEXT_LIMIT:
+            text = text[:REMINDERS_PAGE_TEXT_LIMIT] + "…"
+        text = html.escape(text)
+        if reminder.repeat is not None:
+            status = '\U0001F501'
+            text += f"\n<i>{get_repeat_text(*reminder.repeat)}, отменить: /unrepeat_{reminder.id}</i>"
+        lines.append(f"{i}. {status} [{date}] {text}\n\n")
+    return "".join(lines)
+
+def get_reminders_page_markup(page: ReminderPage) -> InlineKeyboardMarkup | None:
+    keyboard = InlineKeyboardBuilder()
+    navigation_buttons = 0
+    
+    if page.has_previous and page.reminders:
+        first = page.reminders[0]
+        keyboard.button(text="\u25C0", callback_data=ReminderPageCallback(direction=PageDirection.PREVIOUS, expires_in=first.date, id=first.id, offset=page.offset))
+        navigation_buttons += 1
+    
+    if page.has_next and page.reminders:
+        last = page.reminders[-1]
+        keyboard.button(text="\u25B6", callback_data=ReminderPageCallback(direction=PageDirection.NEXT, expires_in=last.date, id=last.id, offset=page.offset + len(page.reminders)))
+        navigation_buttons += 1
+    
+    if page.has_completed:
+        keyboard.button(text="Удалить завершённые напоминания", callback_data=ReminderCallback(action=ReminderAction.DELETE_COMPLETED))
+    
+    if navigation_buttons == 0 and not page.has_completed:
+        return None
+    
+    keyboard.adjust(*([navigation_buttons] if navigation_buttons else []), 1)
+    return keyboard.as_markup()
+
+@dp.message(Command(REMINDERS_COMMAND))
+async def command_reminders_handler(message: Message) -> None:
+    page = await asyncio.to_thread(get_reminders_page, message.chat.id)
+    if len(page.reminders) == 0:
+        await message.answer("У вас нет напоминаний.")
+        return
+    
+    text = get_current_reminders_text(page.reminders)
+    
+    await message.answer(text, reply_markup=get_reminders_page_markup(page))
+
+@dp.message(Command(EXPORT_COMMAND))
+async def command_export_handler(message: Message, command: CommandObject) -> None:
+    try:
+        format = ReminderFormat((command.args or ReminderFormat.CSV.value).strip().casefold().lstrip("."))
+    except ValueError:
+        await message.answer("Укажите формат: /export csv или /export ics")
+        return
+    
+    path = await asyncio.to_thread(export_reminders, message.chat.id, format)
+    if path is None:
+        await message.answer("У вас нет напоминаний.")
+        return
+    
+    try:
+        await message.answer_document(FSInputFile(path, filename=f"reminders.{format.value}"))
+    finally:
+        os.remove(path)
+
+@dp.callback_query(ReminderPageCallback.filter())
+async def handle_reminders_page(query: CallbackQuery, callback_data: ReminderPageCallback) -> None:
+    chat_id = query.from_user.id
+    
+    cursor = (callback_data.expires_in, callback_data.id)
+    page = await asyncio.to_thread(get_reminders_page, chat_id, callback_data.direction, cursor, callback_data.offset)
+    if len(page.reminders) == 0:
+        page = await asyncio.to_thread(get_reminders_page, chat_id)
+    
+    text = get_current_reminders_text(page.reminders, start=page.offset + 1)
+    
+    if text is None:
+        await query.message.edit_text("У вас нет напоминаний.")
+    else:
+        await query.message.edit_text(text, reply_markup=get_reminders_page_markup(page))
+    
+    await query.answer()
+
+async def delete_completed_reminders(chat_id: int) -> int:
+    now = datetime.now()
+    timestamp = calendar.timegm(now.timetuple())
+    
+    return await reminders_writer.execute("DELETE FROM Reminders WHERE chat_id = ? AND expires_in <= ? AND repeat_unit IS NULL", [(chat_id, timestamp)])
+
+@dp.callback_query(ReminderCallback.filter(F.action == ReminderAction.DELETE_COMPLETED))
+async def handle_delete_completed_reminders(query: CallbackQuery, callback_data: ReminderCallback, bot: Bot) -> None:
+    action = callback_data.action
+    
+    chat_id = query.from_user.id
+    
+    if action == ReminderAction.DELETE_COMPLETED:
+        deleted_count = await delete_completed_reminders(chat_id)
+        
+        if deleted_count > 0:
+            page = await asyncio.to_thread(get_reminders_page, chat_id)
+            
+            word = get_word_case(deleted_count, ("неактивное напоминание", "неактивных напоминания", "неактивных напоминаний"))
+            
+            new_text = f"Вы успешно удалили {deleted_count} {word}.\n"
+            
+            reminders_text = get_current_reminders_text(page.reminders)
+            
+            new_text += reminders_text if reminders_text else "На данный момент у вас нет напоминаний."
+            
+            await query.message.edit_text(new_text, reply_markup=get_reminders_page_markup(page))
+        else:
+            await query.message.answer(f"У вас пока нет завершённых напоминаний.")
+    
+    await query.answer()
+
+@reminder_router.message(Command(CANCEL_COMMAND))
+@reminder_router.message(F.text.casefold() == "cancel")
+async def new_reminder_cancel(message: Message, state: FSMContext) -> None:
+    current_state = await state.get_state()
+    if current_state is None:
+        await message.answer("Нечего отменять.", reply_markup=ReplyKeyboardRemove())
+        return
+    
+    await state.clear()
+    
+    if current_state == ImportRemindersState.document.state:
+        await message.answer("Импорт напоминаний отменён.", reply_markup=ReplyKeyboardRemove())
+        return
+    
+    await message.answer("Создание напоминания отменено.", reply_markup=ReplyKeyboardRemove())
+
+@reminder_router.message(Command(REMINDER_COMMAND))
+async def command_new_reminder_handler(message: Message, state: FSMContext) -> None:
+    current_state = await state.get_state()
+    if current_state is not None:
+        await state.clear()
+    
+    await state.set_state(NewReminderState.text)
+    await message.answer("Введите текст напоминания", reply_markup=ReplyKeyboardRemove())
+    
+@reminder_router.message(Command(REPEAT_COMMAND))
+async def command_new_repeating_reminder_handler(message: Message, state: FSMContext) -> None:
+    current_state = await state.get_state()
+    if current_state is not None:
+        await state.clear()
+    
+    await state.set_state(NewReminderState.text)
+    await state.update_data(repeat=True)
+    await message.answer("Введите текст повторяющегося напоминания", reply_markup=ReplyKeyboardRemove())
+
+@dp.message(Command(SUBSCRIBE_COMMAND))
+async def command_subscribe_handler(message: Message, command: CommandObject) -> None:
+    match = SUBSCRIBE_PATTERN.fullmatch(command.args.strip()) if command.args else None
+    if match is None or int(match.group(2)) > 23 or int(match.group(3)) > 59:
+        await message.answer("Укажите город и время в формате <b>ЧЧ:ММ</b>.\nПример использования: /subscribe Санкт-Петербург 08:00")
+        return
+    
+    name = match.group(1)
+    minute = int(match.group(2)) * 60 + int(match.group(3))
+    
+    subscriptions = await asyncio.to_thread(get_chat_subscriptions, message.chat.id)
+    if len(subscriptions) >= SUBSCRIPTIONS_MAX_PER_CHAT:
+        await message.answer(f"Можно оформить не больше <b>{SUBSCRIPTIONS_MAX_PER_CHAT}</b> подписок. Отменить ненужные: /unsubscribe")
+        return
+    
+    try:
+        observation = await mgr.weather_at_place(name)
+    except CityNotFoundError as e:
+        if not e.suggestions:
+            await message.answer("Город не найден :(")
             return
         
+        await message.answer(f"Город не найден :(\nВозможно, вы имели в виду: {get_city_suggestions_text(e.suggestions)}")
+        return
+    except OwmNotFoundError:
+        await message.answer("Город не найден :(")
+        return
+    except OwmError as e:
+        logging.warning("Failed to get weather for %s - %s: %s", name, type(e).__name__, e)
+        await message.answer("Сервис погоды сейчас недоступен, попробуйте позже.")
+        return
+    
+    city_id = observation.location.id
+    city_name = observation.location.name
+    if any(subscription.city_id == city_id and subscription.minute == minute for subscription in subscriptions):
+        await message.answer(f"Вы уже получаете погоду в <b>{html.escape(city_name)}</b> в <b>{format_minute(minute)}</b>.")
+        return
+    
+    id = await add_subscription(message.chat.id, city_id, city_name, minute)
+    await message.answer(f"Подписка оформлена: погода в <b>{html.escape(city_name)}</b> каждый день в <b>{format_minute(minute)}</b>.\nОтменить: /unsubscribe_{id}")
+
+@dp.message(Command(UNSUBSCRIBE_COMMAND))
+async def command_unsubscribe_handler(message: Message) -> None:
+    subscriptions = await asyncio.to_thread(get_chat_subscriptions, message.chat.id)
+    if not subscriptions:
+        await message.answer("У вас нет подписок на погоду.\nОформить: /subscribe Санкт-Петербург 08:00")
+        return
+    
+    lines = ["Подписки на погоду:\n"]
+    for i, subscription in enumerate(subscriptions, start=1):
+        lines.append(f"{i}. <b>{html.escape(subscription.city_name)}</b> в {format_minute(subscription.minute)}, отменить: /unsubscribe_{subscription.id}")
+    await message.answer("\n".join(lines))
+
+@dp.message(Command(re.compile(r"unsubscribe_(\d+)")))
+async def command_unsubscribe_id_handler(message: Message, command: CommandObject) -> None:
+    id = int(command.regexp_match.group(1))
+    
+    if await delete_subscription(message.chat.id, id):
+        await message.answer("Подписка отменена.")
+    else:
+        await message.answer("Подписка не найдена.")
+
+@dp.message(Command(re.compile(r"unrepeat_(\d+)")))
+async def command_unrepeat_handler(message: Message, command: CommandObject) -> None:
+    id = int(command.regexp_match.group(1))
+    
+    if await delete_repeating_reminder(message.chat.id, id):
+        await message.answer("Повторяющееся напоминание отменено.")
+    else:
+        await message.answer("Повторяющееся напоминание не найдено.")
+
+@reminder_router.message(Command(IMPORT_COMMAND))
+async def command_import_handler(message: Message, state: FSMContext, bot: Bot) -> None:
+    await state.clear()
+    
+    if message.document is not None:
+        await import_reminders_document(message, message.document, bot)
+        return
+    
+    await state.set_state(ImportRemindersState.document)
+    await message.answer(IMPORT_PROMPT, reply_markup=ReplyKeyboardRemove())
+
+@reminder_router.message(NewReminderState.text)
+async def new_reminder_text(message: Message, state: FSMContext) -> None:
+    await state.update_data(text=message.text)
+    await state.set_state(NewReminderState.date)
+    await message.answer("Теперь введите время и дату напоминания в формате: <b>ЧЧ:ММ ДД/ММ/ГГГГ</b>\n\nПримечание:\n<i>Дата не обязательна, по умолчанию - текущий день</i>")
+
+class ReminderDateError(ValueError):
+    pass
+
+def parse_reminder_date(text: str, now: datetime) -> datetime:
+    date_time = text.split(" ")
+    if len(date_time) == 0:
+        raise ReminderDateError(f"Вы указали время и дату неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    t = date_time[0].split(":")
+    if len(t) != 2:
+        raise ReminderDateError(f"Вы указали время неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    try:
+        hours = int(t[0])
+    except ValueError:
+        raise ReminderDateError(f"Вы указали время неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    if hours >= 24:
+        raise ReminderDateError(f"Час должен быть меньше 24.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    if hours < 0:
+        raise ReminderDateError(f"Час должен быть больше или равен нулю.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    try:
+        minutes = int(t[1])
+    except ValueError:
+        raise ReminderDateError(f"Вы указали время неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    if minutes >= 60:
+        raise ReminderDateError(f"Минуты должны быть меньше 60.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    if minutes < 0:
+        raise ReminderDateError(f"Минуты должны быть больше или равны нулю.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+    
+    day = now.day
+    month = now.month
+    year = now.year
+    
+    if len(date_time) > 1:
+        d = date_time[1].split('/')
+        if len(d) != 3:
+            raise ReminderDateError(f"Вы указали дату неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+        
+        try:
+            day = int(d[0])
+        except ValueError:
+            raise ReminderDateError(f"Вы указали дату неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+        
+        if day < 0:
+            raise ReminderDateError(f"День не может быть меньше <b>нуля</b>.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+        
+        try:
+            month = int(d[1])
+        except ValueError:
+            raise ReminderDateError(f"Вы указали дату неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+        
+        if not 1 <= month <= 12:
+            raise ReminderDateError(f"Месяц должен быть в диапазоне от <b>1</b> до <b>12</b>.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
+        
         try:
             year = int(d[2])
         except ValueError:
-            await message.answer(f"Вы указали дату неправильно.\nПример: <b>{example_date}</b>")
-            return
+            raise ReminderDateError(f"Вы указали дату неправильно.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
         
         _, max_days = calendar.monthrange(year, month)
         
         if day > max_days:
-            await message.answer(f"Последний день месяца - <b>{max_days}</b>, а не <b>{day}</b>.\nПример: <b>{example_date}</b>")
-            return
-        
-    now = datetime.now()
-    now_timestamp = calendar.timegm(now.timetuple())
-        
-    date = datetime(year, month, day, hours, minutes)
-    timestamp = calendar.timegm(date.timetuple())
+            raise ReminderDateError(f"Последний день месяца - <b>{max_days}</b>, а не <b>{day}</b>.\nПример: <b>{REMINDER_DATE_EXAMPLE}</b>")
     
-    if timestamp < now_timestamp:
-        await message.answer(f"Создание напоминания на прошедшую дату бессмыслено. Введите другую дату.")
-        return
+    date = datetime(year, month, day, hours, minutes)
     
-    data = await state.update_data(date=timestamp)
+    if calendar.timegm(date.timetuple()) < calendar.timegm(now.timetuple()):
+        raise ReminderDateError("Создание напоминания на прошедшую дату бессмыслено. Введите другую дату.")
     
-    await asyncio.to_thread(add_reminder, message.chat.id, data['text'], data['date'])
+    return date
 
+def get_notifies_in_text(date: datetime, now: datetime) -> str:
+    from dateutil.relativedelta import relativedelta
+    
     diff_date = relativedelta(date, now)
     
     time_values = (
@@ -925,32 +3880,153 @@ async def new_reminder_date(message: Message, state: FSMContext) -> None:
         if add_comma: notifies_in += ", "
         add_comma = True
         notifies_in += f"{value} "
-        cases: tuple[str, str, str] = None
-        match unit:
-            case TimeUnit.YEAR: cases = ("год", "года", "лет")
-            case TimeUnit.MONTH: cases = ("месяц", "месяца", "месяцев")
-            case TimeUnit.DAY: cases = ("день", "дня", "дней")
-            case TimeUnit.HOUR: cases = ("час", "часа", "часов")
-            case TimeUnit.MINUTE: cases = ("минуту", "минуты", "минут")
-            case TimeUnit.SECOND: cases = ("секунду", "секунды", "секунд")
-        notifies_in += get_word_case(value, cases)
+        notifies_in += get_word_case(value, TIME_UNIT_CASES[unit])
     notifies_in += '.'
     
+    return notifies_in
+
+@reminder_router.message(NewReminderState.date)
+async def new_reminder_date(message: Message, state: FSMContext) -> None:
+    now = datetime.now()
+    
+    try:
+        date = parse_reminder_date(message.text, now)
+    except ReminderDateError as e:
+        await message.answer(str(e))
+        return
+    
+    data = await state.update_data(date=calendar.timegm(date.timetuple()))
+    
+    if data.get('repeat'):
+        await state.set_state(NewReminderState.repeat)
+        await message.answer(REPEAT_PROMPT)
+        return
+    
+    await add_reminder(message.chat.id, data['text'], data['date'])
+    
+    notifies_in = get_notifies_in_text(date, now)
     await message.answer(f"Напоминание успешно создано! Я напомню вам об этом через <b>{notifies_in}</b>")
+    
+    await state.clear()
+
+@reminder_router.message(NewReminderState.repeat)
+async def new_reminder_repeat(message: Message, state: FSMContext) -> None:
+    repeat = parse_repeat_rule(message.text or "")
+    if repeat is None:
+        await message.answer(f"Не удалось распознать период повторения.\n\n{REPEAT_PROMPT}")
+        return
+    
+    data = await state.get_data()
+    reminder = await add_reminder(message.chat.id, data['text'], data['date'], repeat)
+    
+    date = datetime.fromtimestamp(reminder.date, UTC).strftime("%H:%M, %d/%m/%Y")
+    await message.answer(
+        f"Повторяющееся напоминание создано! Я напомню вам об этом <b>{date}</b>, а затем <b>{get_repeat_text(*repeat)}</b>.\n\n"
+        f"Отменить: /unrepeat_{reminder.id}"
+    )
+    
+    await state.clear()
+
+async def import_reminders_document(message: Message, document: Document, bot: Bot) -> None:
+    if document.file_size is not None and document.file_size > REMINDERS_IMPORT_MAX_FILE_SIZE:
+        await message.answer(f"Файл слишком большой. Максимальный размер - <b>{REMINDERS_IMPORT_MAX_FILE_SIZE // 1024 // 1024} МБ</b>.")
+        return
+    
+    with tempfile.TemporaryFile() as file:
+        await bot.download(document, destination=file)
+        file.seek(0)
+        format = get_import_format(document.file_name, file.read(1024))
+        file.seek(0)
+        
+        imported, errors, truncated = await import_reminders(message.chat.id, file, format)
+    
+    lines = [f"Импортировано напоминаний: <b>{imported}</b>."]
+    if truncated:
+        lines.append(f"Обработаны только первые {REMINDERS_IMPORT_MAX_ROWS} записей.")
+    if errors:
+        lines.append(f"\nПропущено записей: <b>{len(errors)}</b>.")
+        lines.extend(f"Строка {line}: {error}" for line, error in errors[:REMINDERS_IMPORT_ERRORS_SHOWN])
+        if len(errors) > REMINDERS_IMPORT_ERRORS_SHOWN:
+            lines.append("…")
+    
+    await message.answer("\n".join(lines))
 
+@reminder_router.message(ImportRemindersState.document, F.document)
+async def import_reminders_file(message: Message, state: FSMContext, bot: Bot) -> None:
     await state.clear()
+    await import_reminders_document(message, message.document, bot)
+
+@reminder_router.message(ImportRemindersState.document)
+async def import_reminders_waiting(message: Message) -> None:
+    await message.answer("Отправьте файл CSV или iCalendar, либо /cancel для отмены.")
+
+def get_due_reminders(ids: list[int]) -> dict[int, tuple[str, int | None, int | None, int | None, int]]:
+    reminders: dict[int, tuple[str, int | None, int | None, int | None, int]] = {}
+    
+    with reminders_pool.connection() as conn:
+        for i in range(0, len(ids), REMINDERS_TEXT_BATCH_SIZE):
+            batch = ids[i:i + REMINDERS_TEXT_BATCH_SIZE]
+            cur = conn.execute(
+                f"SELECT id, content, repeat_unit, repeat_every, starts_at, occurrence FROM Reminders WHERE id IN ({', '.join('?' * len(batch))})",
+                batch
+            )
+            reminders.update((row[0], row[1:]) for row in cur.fetchall())
+    
+    return reminders
+
+async def reschedule_delivered_rules() -> None:
+    delivered = reminder_delivery.take_delivered_rules()
+    if not delivered:
+        return
+    
+    timestamp = get_current_timestamp()
+    reminders = await asyncio.to_thread(get_due_reminders, [id for _, id in delivered])
+        
+    rescheduled: list[tuple[int, int, int]] = []
+    finished: list[tuple[int]] = []
+    for chat_id, id in delivered:
+        reminder = reminders.get(id)
+        if reminder is None or reminder[1] is None:
+            continue
+        
+        _, repeat_unit, repeat_every, starts_at, occurrence = reminder
+        
+        next_occurrence = get_next_occurrence(starts_at, TimeUnit(repeat_unit), repeat_every, occurrence, timestamp)
+        if next_occurrence is None:
+            finished.append((id,))
+        else:
+            rescheduled.append((*next_occurrence, id))
+    
+    if rescheduled:
+        await reminders_writer.execute("UPDATE Reminders SET expires_in = ?, occurrence = ? WHERE id = ?", rescheduled)
+        
+        chat_ids = {id: chat_id for chat_id, id in delivered}
+        for date, _, id in rescheduled:
+            reminder_scheduler.push_if_loaded(chat_ids[id], id, date)
+    
+    if finished:
+        await reminders_writer.execute("DELETE FROM Reminders WHERE id = ?", finished)
 
 async def check_reminders_expiration() -> None:
-    now = datetime.now()
-    timestamp = calendar.timegm(now.timetuple())
+    await reschedule_delivered_rules()
     
-    for chat_id, reminders in REMINDERS.items():
-        for reminder in reminders:
-            if reminder.active and timestamp > reminder.date:
-                reminder.active = False
-                
-                date = datetime.fromtimestamp(reminder.date, UTC).strftime("%H:%M, %d/%m/%Y")
-                await bot.send_message(chat_id, f"Напоминание:\n\n{reminder.text}\n\n{date}")
+    timestamp = get_current_timestamp()
+    
+    due = reminder_scheduler.pop_due(timestamp)
+    if not due:
+        return
+    
+    reminders = await asyncio.to_thread(get_due_reminders, [id for _, id, _ in due])
+    
+    for chat_id, id, expires_in in due:
+        reminder = reminders.get(id)
+        if reminder is None:
+            continue
+        
+        text, repeat_unit, *_ = reminder
+        
+        date = datetime.fromtimestamp(expires_in, UTC).strftime("%H:%M, %d/%m/%Y")
+        reminder_delivery.submit(chat_id, f"Напоминание:\n\n{html.escape(text)}\n\n{date}", expires_in, id, repeat_unit is not None)
 
 class RpsVariant(Enum):
     ROCK = 1
@@ -1007,41 +4083,617 @@ async def command_rps_handler(message: Message, command: CommandObject) -> None:
     else:
         await message.answer(f"Ничья! Я выбрал <b>{variant.name_acusative}</b>.")
 
-def load_all_reminders() -> None:
-    now = datetime.now()
-    timestamp = calendar.timegm(now.timetuple())
+startup_phases: dict[str, float] = {}
+last_startup_phase = STARTUP_TIME
+
+def mark_startup_phase(name: str) -> None:
+    global last_startup_phase
     
-    for address, _, files in os.walk("./databases/"):
-        for name in files:
-            chat_id = int(name[:-3])
-            path = os.path.join(address, name)
-            
-            result = None
-            with sqlite3.connect(path) as conn:
-                cur = conn.cursor()
-                cur.execute("SELECT * FROM Reminders")
-                result = cur.fetchall()
+    now = time.perf_counter()
+    startup_phases[name] = startup_phases.get(name, 0) + now - last_startup_phase
+    last_startup_phase = now
+
+def log_startup(mode: str) -> None:
+    mark_startup_phase("start")
+    phases = ", ".join(f"{name} {seconds:.3f} s" for name, seconds in startup_phases.items())
+    logging.info("%s starts %.3f s after startup: %s", mode, time.perf_counter() - STARTUP_TIME, phases)
+
+first_update_handled = False
+
+@dp.update.outer_middleware()
+async def first_update_middleware(handler, event: Update, data: dict[str, Any]) -> Any:
+    global first_update_handled
+    
+    if not first_update_handled:
+        first_update_handled = True
+        logging.info("First update received %.3f s after startup", time.perf_counter() - STARTUP_TIME)
+    
+    return await handler(event, data)
+
+async def handler_metrics_middleware(handler, event: Message | CallbackQuery, data: dict[str, Any]) -> Any:
+    name = data["handler"].callback.__name__
+    
+    with handler_latency.measure(name):
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+
+dp.message.middleware(handler_metrics_middleware)
+dp.callback_query.middleware(handler_metrics_middleware)
+
+async def telegram_metrics_middleware(make_request, bot: Bot, method: Any) -> Any:
+    name = method.__api_method__
+    
+    with telegram_latency.measure(name):
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            telegram_requests.inc(name, type(e).__name__)
+            raise
+    
+    telegram_requests.inc(name, "ok")
+    return response
+
+metrics.register(MetricGauge("bot_reminders_scheduled", "Reminders loaded into the in-memory scheduler", lambda: len(reminder_scheduler)))
+metrics.register(MetricGauge("bot_reminder_delivery_queue_depth", "Reminders waiting to be sent", lambda: reminder_delivery.pending))
+metrics.register(MetricGauge("bot_weather_cache_hits_total", "Weather lookups served from the cache", lambda: mgr.cache.hits, "counter"))
+metrics.register(MetricGauge("bot_weather_cache_misses_total", "Weather lookups that went to OWM", lambda: mgr.cache.misses, "counter"))
+metrics.register(MetricGauge("bot_weather_cache_stale_total", "Stale weather served while a background refresh runs", lambda: mgr.cache.stale, "counter"))
+metrics.register(MetricGauge("bot_weather_cache_degraded_total", "Last known weather served because OWM failed or was too slow", lambda: mgr.cache.degraded, "counter"))
+metrics.register(MetricGauge("bot_weather_prefetch_calls_total", "OWM calls spent prefetching popular cities", lambda: mgr.prefetcher.calls if mgr.prefetcher else 0, "counter"))
+metrics.register(MetricGauge("bot_weather_prefetch_skipped_total", "Popular cities not prefetched because the call budget ran out", lambda: mgr.prefetcher.skipped if mgr.prefetcher else 0, "counter"))
+metrics.register(MetricGauge("bot_weather_prefetch_hits_total", "Weather lookups answered from a prefetched observation", lambda: mgr.cache.prefetch_hits, "counter"))
+metrics.register(MetricGauge("bot_subscription_deliveries_total", "Weather subscription messages queued for delivery", lambda: subscription_sender.deliveries, "counter"))
+metrics.register(MetricGauge("bot_subscription_cities_total", "Distinct cities sent to subscribers, one per delivery minute", lambda: subscription_sender.cities, "counter"))
+metrics.register(MetricGauge("bot_owm_circuit_state", "OWM circuit breaker state: 0 closed, 1 half-open, 2 open", lambda: mgr.backend.breaker.state.value))
+metrics.register(MetricGauge("bot_owm_circuit_state_seconds", "Seconds since the OWM circuit breaker last changed state", lambda: time.monotonic() - mgr.backend.breaker.changed_at))
+metrics.register(MetricGauge("bot_owm_circuit_opened_total", "Times the OWM circuit breaker opened", lambda: mgr.backend.breaker.opened, "counter"))
+metrics.register(MetricGauge("bot_owm_retry_budget_tokens", "Retries OWM calls may still spend", lambda: mgr.backend.budget.tokens))
+metrics.register(MetricGauge("bot_fsm_cache_hits_total", "FSM reads served from memory", lambda: fsm_storage.hits, "counter"))
+metrics.register(MetricGauge("bot_fsm_cache_misses_total", "FSM reads that went to SQLite", lambda: fsm_storage.misses, "counter"))
+metrics.register(MetricGauge("bot_uptime_seconds", "Seconds since the process started", lambda: time.perf_counter() - STARTUP_TIME))
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+async def start_metrics_server(port: int) -> web.AppRunner | None:
+    app = web.Application()
+    app.router.add_get(METRICS_PATH, handle_metrics)
+    
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logging.warning("Failed to serve metrics on %s:%d - %s", METRICS_HOST, port, e)
+        await runner.cleanup()
+        return None
+    
+    logging.info("Metrics are served on http://%s:%d%s", METRICS_HOST, port, METRICS_PATH)
+    return runner
+
+class ReminderLeadership:
+    def __init__(self, bot: Bot, scheduler: "AsyncIOScheduler") -> None:
+        self.bot = bot
+        self.scheduler = scheduler
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+        self.is_leader = False
+        self.scheduler_task: asyncio.Task | None = None
+    
+    def try_acquire(self, watermark: int) -> tuple[bool, int]:
+        now = time.time()
+        
+        with reminders_pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO Leases (name, owner, expires_at, watermark) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, "
+                "watermark = CASE WHEN Leases.owner = excluded.owner THEN excluded.watermark ELSE Leases.watermark END "
+                "WHERE Leases.owner = excluded.owner OR Leases.expires_at < ?",
+                (LEADER_LEASE_NAME, self.owner, now + LEADER_LEASE_TTL, watermark, now)
+            )
+            owner, watermark = conn.execute("SELECT owner, watermark FROM Leases WHERE name = ?", (LEADER_LEASE_NAME,)).fetchone()
+        
+        return owner == self.owner, watermark
+    
+    def release(self, watermark: int) -> None:
+        with reminders_pool.connection() as conn:
+            conn.execute(
+                "UPDATE Leases SET expires_at = 0, watermark = ? WHERE name = ? AND owner = ?",
+                (watermark, LEADER_LEASE_NAME, self.owner)
+            )
+    
+    def get_watermark(self, fired_until: int) -> int:
+        earliest = reminder_delivery.get_earliest_due()
+        if earliest is None:
+            return fired_until
+        
+        return min(fired_until, int(earliest) - 1)
+    
+    async def start(self, watermark: int) -> None:
+        from apscheduler.triggers.interval import IntervalTrigger
+        
+        self.is_leader = True
+        reminder_delivery.take_delivered_rules()
+        
+        since = None
+        if watermark and get_current_timestamp() - watermark < LEADER_CATCHUP_LIMIT:
+            since = watermark
+        
+        logging.info("Reminders lease acquired by %s, catching up since %s", self.owner, since)
+        
+        await asyncio.to_thread(reset_reminders_window, since)
+        await load_upcoming_reminders(since)
+        
+        self.scheduler_task = asyncio.create_task(reminder_scheduler.run())
+        self.scheduler.add_job(load_upcoming_reminders, IntervalTrigger(seconds=REMINDERS_LOAD_INTERVAL), id="load_reminders")
+        self.scheduler.add_job(poll_new_reminders, IntervalTrigger(seconds=REMINDERS_POLL_INTERVAL), id="poll_reminders")
+        self.scheduler.add_job(compact_reminders, IntervalTrigger(seconds=REMINDERS_COMPACTION_INTERVAL), id="compact_reminders")
+        self.scheduler.add_job(purge_fsm_states, IntervalTrigger(seconds=FSM_PURGE_INTERVAL), id="purge_fsm_states")
+        self.scheduler.add_job(subscription_sender.run, IntervalTrigger(seconds=SUBSCRIPTIONS_POLL_INTERVAL), id="send_subscriptions")
+    
+    async def stop(self) -> None:
+        self.is_leader = False
+        
+        for id in ("load_reminders", "poll_reminders", "compact_reminders", "purge_fsm_states", "send_subscriptions"):
+            self.scheduler.remove_job(id)
+        subscription_sender.sent_until = None
+        
+        if self.scheduler_task is not None:
+            self.scheduler_task.cancel()
+            await asyncio.gather(self.scheduler_task, return_exceptions=True)
+            self.scheduler_task = None
+        
+        reminder_scheduler.clear()
+    
+    async def run(self) -> None:
+        try:
+            while True:
+                watermark = self.get_watermark(reminder_scheduler.fired_until) if self.is_leader else 0
                 
-                reminders: list[Reminder] = []
-                for id, date, text in result:
-                    active = timestamp < date
-                    reminders.append(Reminder(id, date, text, active=active))
-                REMINDERS[chat_id] = reminders
+                try:
+                    is_leader, watermark = await asyncio.to_thread(self.try_acquire, watermark)
+                except sqlite3.Error:
+                    logging.exception("Failed to renew the reminders lease")
+                    is_leader = False
+                
+                if is_leader and not self.is_leader:
+                    await self.start(watermark)
+                elif self.is_leader and not is_leader:
+                    logging.warning("Reminders lease lost by %s", self.owner)
+                    await self.stop()
+                
+                await asyncio.sleep(LEADER_LEASE_RENEW_INTERVAL)
+        finally:
+            if self.is_leader:
+                fired_until = reminder_scheduler.fired_until
+                await self.stop()
+                await reminder_delivery.drain(DELIVERY_DRAIN_TIMEOUT)
+                await reschedule_delivered_rules()
+                await asyncio.to_thread(self.release, self.get_watermark(fired_until))
+
+def get_update_chat_id(update: Update) -> int:
+    event = update.event
+    
+    if isinstance(event, Message):
+        return event.chat.id
+    if isinstance(event, CallbackQuery) and event.message is not None:
+        return event.message.chat.id
+    
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else 0
+
+async def process_raw_update(update: dict[str, Any]) -> None:
+    await dp.feed_raw_update(bot, update)
+
+async def handle_raw_update(update: dict[str, Any], semaphore: asyncio.Semaphore) -> None:
+    try:
+        await process_raw_update(update)
+    except Exception:
+        logging.exception("Failed to handle update %s", update.get("update_id"))
+    finally:
+        semaphore.release()
+
+def get_update_batch(updates: multiprocessing.queues.Queue) -> str | None:
+    parent = multiprocessing.parent_process()
+    
+    while True:
+        try:
+            return updates.get(timeout=WORKER_PARENT_CHECK_INTERVAL)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logging.warning("Supervisor process exited, stopping")
+                return None
+
+async def feed_updates(updates: multiprocessing.queues.Queue) -> None:
+    semaphore = asyncio.Semaphore(WORKER_MAX_CONCURRENT_UPDATES)
+    tasks: set[asyncio.Task] = set()
+    
+    while True:
+        batch = await asyncio.to_thread(get_update_batch, updates)
+        if batch is None:
+            break
+        
+        for update in json.loads(batch):
+            await semaphore.acquire()
+            task = asyncio.create_task(handle_raw_update(update, semaphore))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    
+    await asyncio.gather(*tasks)
+
+def run_worker(index: int, updates: multiprocessing.queues.Queue, telegram_api: str | None, metrics_port: int | None, owm_api: str | None, prefetch_budget: int) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout, format=f"%(levelname)s:worker-{index}:%(name)s:%(message)s")
+    
+    asyncio.run(main(telegram_api, updates, metrics_port=metrics_port + index + 1 if metrics_port else None, owm_api=owm_api, prefetch_budget=prefetch_budget))
+
+class WorkerPool:
+    def __init__(self, count: int, telegram_api: str | None, metrics_port: int | None, owm_api: str | None, prefetch_budget: int) -> None:
+        self.context = multiprocessing.get_context("spawn")
+        self.telegram_api = telegram_api
+        self.metrics_port = metrics_port
+        self.owm_api = owm_api
+        self.prefetch_budget = prefetch_budget
+        self.queues = [self.context.Queue(WORKER_QUEUE_SIZE) for _ in range(count)]
+        self.processes = [self.start_worker(index) for index in range(count)]
+    
+    def __len__(self) -> int:
+        return len(self.processes)
+    
+    def start_worker(self, index: int) -> multiprocessing.Process:
+        process = self.context.Process(target=run_worker, args=(index, self.queues[index], self.telegram_api, self.metrics_port, self.owm_api, self.prefetch_budget), name=f"worker-{index}")
+        process.start()
+        return process
+    
+    def restart_dead_workers(self) -> None:
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                logging.warning("Worker %d exited with code %s, restarting", index, process.exitcode)
+                self.processes[index] = self.start_worker(index)
+    
+    async def submit(self, index: int, updates: list[dict[str, Any]]) -> None:
+        batch = json.dumps(updates, ensure_ascii=False)
+        
+        while True:
+            try:
+                self.queues[index].put_nowait(batch)
+                return
+            except queue.Full:
+                self.restart_dead_workers()
+                await asyncio.sleep(POLLING_RETRY_DELAY / 10)
+    
+    def close(self) -> None:
+        for updates in self.queues:
+            updates.put(None)
+        
+        for process in self.processes:
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+@dataclass
+class WebhookConfig:
+    url: str
+    host: str
+    port: int
+    path: str = WEBHOOK_PATH
+    secret: str = ""
+
+class WebhookServer:
+    def __init__(self, config: WebhookConfig, process: Callable[[dict[str, Any]], Awaitable[None]]) -> None:
+        self.config = config
+        self.process = process
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(WEBHOOK_QUEUE_SIZE)
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secret, self.config.secret):
+            self.unauthorized += 1
+            return web.Response(status=401)
+        
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        
+        self.accepted += 1
+        return web.Response()
+    
+    async def worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            
+            try:
+                await self.process(update)
+            except Exception:
+                logging.exception("Failed to handle update %s", update.get("update_id"))
+            finally:
+                self.queue.task_done()
+    
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "queue_depth": self.queue.qsize()
+        }
+    
+    async def run(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.config.path, self.handle)
+        
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.config.host, self.config.port).start()
+        
+        workers = [asyncio.create_task(self.worker()) for _ in range(WEBHOOK_WORKERS)]
+        
+        try:
+            await bot.set_webhook(
+                self.config.url,
+                secret_token=self.config.secret,
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            log_startup(f"Webhook on {self.config.host}:{self.config.port}")
+            
+            await asyncio.Future()
+        finally:
+            await runner.cleanup()
+            
+            try:
+                await asyncio.wait_for(self.queue.join(), WEBHOOK_SHUTDOWN_TIMEOUT)
+            except TimeoutError:
+                logging.warning("Dropped %d queued webhook updates on shutdown", self.queue.qsize())
+            
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            
+            stats = self.get_stats()
+            logging.info("Webhook stopped: %d updates accepted, %d rejected as overloaded, %d unauthorized", stats["accepted"], stats["rejected"], stats["unauthorized"])
+
+async def run_until_stopped(awaitable: Awaitable[None]) -> None:
+    task = asyncio.ensure_future(awaitable)
+    
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, task.cancel)
+    
+    try:
+        await task
+    except asyncio.CancelledError:
+        logging.info("Stopped")
+
+async def poll_updates(workers: WorkerPool) -> None:
+    await bot.delete_webhook()
+    log_startup(f"Polling with {len(workers)} workers")
+    
+    allowed_updates = dp.resolve_used_update_types()
+    request_timeout = int(bot.session.timeout + POLLING_TIMEOUT)
+    offset = None
+    
+    while True:
+        workers.restart_dead_workers()
+        
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates, request_timeout=request_timeout)
+        except TelegramAPIError as e:
+            logging.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+            await asyncio.sleep(POLLING_RETRY_DELAY)
+            continue
+        
+        batches: dict[int, list[dict[str, Any]]] = {}
+        for update in updates:
+            index = get_update_chat_id(update) % len(workers)
+            batches.setdefault(index, []).append(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+        
+        for index, batch in batches.items():
+            await workers.submit(index, batch)
+
+async def supervise_workers(count: int, telegram_api: str | None = None, webhook: WebhookConfig | None = None, metrics_port: int | None = METRICS_PORT, owm_api: str | None = None, prefetch_budget: int = PREFETCH_CALLS_PER_MINUTE) -> None:
+    create_app(telegram_api, owm_api)
+    commands_task = asyncio.create_task(set_commands())
+    
+    metrics_runner = await start_metrics_server(metrics_port) if metrics_port else None
+    if 0 < prefetch_budget < count:
+        logging.warning("Prefetch budget of %d calls per minute is less than one per worker, prefetching is disabled", prefetch_budget)
+    workers = WorkerPool(count, telegram_api, metrics_port, owm_api, prefetch_budget // count)
+    
+    async def route_update(update: dict[str, Any]) -> None:
+        index = get_update_chat_id(Update.model_validate(update, context={"bot": bot})) % len(workers)
+        await workers.submit(index, [update])
+    
+    try:
+        if webhook is None:
+            await run_until_stopped(poll_updates(workers))
+        else:
+            await run_until_stopped(WebhookServer(webhook, route_update).run())
+    finally:
+        await asyncio.to_thread(workers.close)
+        await commands_task
+        await bot.session.close()
+        
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+def log_stats() -> None:
+    stats = reminders_pool.get_stats()
+    logging.info(
+        "Reminders database pool: %d hits, %d misses, %d evictions, %d idle, hit rate %.1f%%",
+        stats["hits"], stats["misses"], stats["evictions"], stats["idle"], stats["hit_rate"] * 100
+    )
+    logging.info("Reminders writer: %d operations in %d group commits", reminders_writer.operations, reminders_writer.batches)
+    
+    stats = fsm_storage.get_stats()
+    logging.info(
+        "FSM storage: %d hits, %d misses, %d cached, hit rate %.1f%%",
+        stats["hits"], stats["misses"], stats["cached"], stats["hit_rate"] * 100
+    )
+    
+    stats = mgr.cache.get_stats()
+    logging.info(
+        "Weather cache: %d hits, %d misses, %d coalesced, %d stale, %d degraded, %d loaded from disk, %d flushes to disk, %d places, %d observations",
+        stats["hits"], stats["misses"], stats["coalesced"], stats["stale"], stats["degraded"], stats["loaded"], stats["flushes"], stats["places"], stats["observations"]
+    )
+    
+    if mgr.prefetcher is not None:
+        stats = mgr.prefetcher.get_stats()
+        logging.info(
+            "Weather prefetch: %d cities tracked, %d hot, %d refreshed in %d calls, %d skipped over budget, %d prefetched hits, hit rate %.1f%% (%.1f%% without prefetching)",
+            stats["tracked"], stats["hot"], stats["refreshed"], stats["calls"], stats["skipped"], stats["prefetch_hits"], stats["hit_rate"] * 100, stats["hit_rate_without_prefetch"] * 100
+        )
+    
+    stats = mgr.backend.get_stats()
+    logging.info(
+        "OWM: circuit %s for %.0f s, %d failures, opened %d times, %d rejected, %d retries, %d retries over budget",
+        stats["state"], stats["state_seconds"], stats["failures"], stats["opened"], stats["rejected"], stats["retries"], stats["retries_exhausted"]
+    )
+    
+    stats = subscription_sender.get_stats()
+    logging.info(
+        "Weather subscriptions: %d deliveries for %d cities over %d minutes, %d cities fetched from OWM, %d deliveries failed",
+        stats["deliveries"], stats["cities"], stats["minutes"], stats["fetched"], stats["failed"]
+    )
+    
+    stats = reminder_delivery.get_stats()
+    logging.info(
+        "Reminder delivery: %d queued, %d sent, %d failed, %d retries, latency %.3f s avg / %.3f s max, lag %.3f s avg / %.3f s max",
+        stats["queue_depth"], stats["sent"], stats["failed"], stats["retries"],
+        stats["latency_avg"], stats["latency_max"], stats["lag_avg"], stats["lag_max"]
+    )
 
-async def main() -> None:
-    await bot.set_my_commands(commands=ALL_COMMANDS)
+def read_token(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+def create_app(telegram_api: str | None = None, owm_api: str | None = None) -> None:
+    global bot, mgr
+    
+    bot = Bot(token=read_token(TELEGRAM_TOKEN_PATH), default=DefaultBotProperties(parse_mode="html"))
+    if telegram_api is not None:
+        bot.session.api = TelegramAPIServer.from_base(telegram_api)
+    bot.session.middleware(telegram_metrics_middleware)
+    
+    backend = ResilientWeatherBackend(OwmWeatherBackend(read_token(OWM_TOKEN_PATH), owm_api or OWM_API_URL))
+    mgr = AsyncWeatherManager(backend, WeatherCache(WEATHER_CACHE_TTL, WEATHER_CACHE_SIZE, persistent=True))
     
     dp.include_router(reminder_router)
+    mark_startup_phase("clients")
+
+async def set_commands() -> None:
+    try:
+        await bot.set_my_commands(commands=ALL_COMMANDS)
+    except TelegramAPIError as e:
+        logging.error("Failed to set bot commands - %s: %s", type(e).__name__, e)
+
+async def main(telegram_api: str | None = None, updates: multiprocessing.queues.Queue | None = None, webhook: WebhookConfig | None = None, metrics_port: int | None = METRICS_PORT, owm_api: str | None = None, prefetch_budget: int = PREFETCH_CALLS_PER_MINUTE) -> None:
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+    
+    mark_startup_phase("imports")
+    create_app(telegram_api, owm_api)
+    
+    commands_task = asyncio.create_task(set_commands()) if updates is None else None
+    
+    mgr.city_index = CityIndex.open()
+    if mgr.city_index is None:
+        logging.info("City index %s not found, place names are resolved by OWM", CITIES_DATABASE)
+    mark_startup_phase("city index")
+    
+    writer_task = asyncio.create_task(reminders_writer.run())
+    delivery_task = asyncio.create_task(reminder_delivery.run(bot))
+    mgr.cache.refresh(mgr.cache.load())
+    metrics_runner = await start_metrics_server(metrics_port) if metrics_port else None
     
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_reminders_expiration, IntervalTrigger(seconds=10))
+    scheduler.add_job(log_stats, IntervalTrigger(seconds=STATS_LOG_INTERVAL))
+    if prefetch_budget > 0:
+        mgr.prefetcher = WeatherPrefetcher(mgr, prefetch_budget)
+        scheduler.add_job(mgr.prefetcher.run, IntervalTrigger(seconds=PREFETCH_INTERVAL), id="prefetch_weather")
+    scheduler.add_job(mgr.cache.flush, IntervalTrigger(seconds=WEATHER_FLUSH_INTERVAL), id="flush_weather_cache")
     scheduler.start()
     
     logging.getLogger('apscheduler.executors.default').setLevel(logging.WARNING)
     
-    await dp.start_polling(bot)
+    leadership = ReminderLeadership(bot, scheduler)
+    leadership_task = asyncio.create_task(leadership.run())
+    
+    try:
+        if updates is not None:
+            log_startup("Worker")
+            await feed_updates(updates)
+        elif webhook is not None:
+            await run_until_stopped(WebhookServer(webhook, process_raw_update).run())
+        else:
+            await bot.delete_webhook()
+            log_startup("Polling")
+            await dp.start_polling(bot)
+    finally:
+        leadership_task.cancel()
+        await asyncio.gather(leadership_task, return_exceptions=True)
+        delivery_task.cancel()
+        scheduler.shutdown(wait=False)
+        await mgr.cache.close()
+        reminders_writer.close()
+        await writer_task
+        reminders_pool.close()
+        await mgr.close()
+        
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        
+        if commands_task is not None:
+            await commands_task
+        
+        if updates is not None or webhook is not None:
+            await bot.session.close()
     
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-    load_all_reminders()
-    asyncio.run(main())
\ No newline at end of file
+    
+    if len(sys.argv) == 3 and sys.argv[1] == "build-city-index":
+        os.makedirs(DATABASES_DIRECTORY, exist_ok=True)
+        build_city_index(sys.argv[2])
+        sys.exit()
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes; chats are partitioned across them by id")
+    parser.add_argument("--telegram-api", help="Base URL of a Telegram Bot API server to use instead of api.telegram.org")
+    parser.add_argument("--owm-api", help=f"Base URL of an OpenWeatherMap API to use instead of {OWM_API_URL}")
+    parser.add_argument("--prefetch-budget", type=int, default=PREFETCH_CALLS_PER_MINUTE, help="OWM calls per minute the bot may spend keeping popular cities cached, split evenly across workers; 0 disables prefetching")
+    parser.add_argument("--webhook-url", help="Public HTTPS URL to receive updates on instead of long polling")
+    parser.add_argument("--webhook-host", default="127.0.0.1")
+    parser.add_argument("--webhook-port", type=int, default=8080)
+    parser.add_argument("--webhook-path", default=WEBHOOK_PATH)
+    parser.add_argument("--webhook-secret", default=secrets.token_urlsafe(32), help="Secret token Telegram sends with every update (random by default)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help=f"Port for Prometheus metrics on {METRICS_HOST}, workers use the following ports; 0 disables")
+    args = parser.parse_args()
+    
+    webhook = None
+    if args.webhook_url is not None:
+        webhook = WebhookConfig(args.webhook_url, args.webhook_host, args.webhook_port, args.webhook_path, args.webhook_secret)
+    
+    mark_startup_phase("imports")
+    create_reminders_db()
+    migrate_chat_databases()
+    mark_startup_phase("databases")
+    
+    if args.workers > 1:
+        asyncio.run(supervise_workers(args.workers, args.telegram_api, webhook, args.metrics_port, args.owm_api, args.prefetch_budget))
+    else:
+        asyncio.run(main(args.telegram_api, webhook=webhook, metrics_port=args.metrics_port, owm_api=args.owm_api, prefetch_budget=args.prefetch_budget))
\ No newline at end of file